@@ -1,4 +1,5 @@
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
 from datetime import datetime
 from typing import Optional, Tuple
@@ -12,6 +13,11 @@ class AemetAdapter:
     
     def __init__(self, api_key: str):
         self.api_key = api_key
+        # Keep-alive session: reused across reruns when the adapter is cached.
+        # The metadata call and the 'datos' redirect hit different hosts, so
+        # keep a connection open per host instead of reconnecting (TLS) each time
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
         
     def get_radar_composite_url(self) -> Optional[str]:
         """
@@ -30,7 +36,7 @@ class AemetAdapter:
         try:
             # 1. Request Meta-data
             # AEMET returns a JSON with 'datos' field pointing to the actual resource
-            response = requests.get(endpoint, headers=headers, timeout=5)
+            response = self.session.get(endpoint, headers=headers, timeout=5)
             response.raise_for_status()
             
             data = response.json()
@@ -1,6 +1,7 @@
 import os
 import hashlib
-from typing import Optional
+from contextlib import nullcontext
+from typing import Optional, List, Tuple, Union
 from datetime import datetime
 from supabase import create_client, Client
 from pathlib import Path
@@ -75,30 +76,46 @@ class SupabaseClient:
         Uploads a local file -> Supabase Storage -> Records in DB.
         Returns the Public URL.
         """
+        return self.upload_files([(file_path, ext, mime, bucket)], bbox, variable, timestamp)[0]
+
+    def upload_files(self, files: List[Tuple[Union[str, bytes], str, str, str]], bbox: tuple, variable: str, timestamp: datetime) -> List[Optional[str]]:
+        """
+        Uploads several renderings of one layer (e.g. TIFF + PNG), given as
+        (file_path or encoded bytes, ext, mime, bucket), over the client's pooled connection and
+        records all of them in the DB with a single batched upsert.
+        Returns the Public URL of each file (None where the upload failed).
+        """
         region_hash = self._get_region_hash(bbox)
-        filename = self._generate_filename(region_hash, variable, timestamp, ext)
+        urls, rows = [], []
         
-        try:
-            # 1. Upload to Storage
-            with open(file_path, 'rb') as f:
-                self.client.storage.from_(bucket).upload(
-                    file=f,
-                    path=filename,
-                    file_options={"content-type": mime, "upsert": "true"}
-                )
-            
-            # 2. Record in DB
-            # We treat filename as unique Key.
-            self.client.table(self.table).upsert({
-                "filename": filename,
-                "variable": variable,
-                "timestamp": timestamp.isoformat(),
-                "region_hash": region_hash
-            }).execute()
-            
-            return self.client.storage.from_(bucket).get_public_url(filename)
-            
-        except Exception as e:
-            print(f"Supabase Upload Error: {e}")
-            return None
-            return None
+        # 1. Upload to Storage
+        for source, ext, mime, bucket in files:
+            filename = self._generate_filename(region_hash, variable, timestamp, ext)
+            try:
+                with nullcontext(source) if isinstance(source, bytes) else open(source, 'rb') as f:
+                    self.client.storage.from_(bucket).upload(
+                        file=f,
+                        path=filename,
+                        file_options={"content-type": mime, "upsert": "true"}
+                    )
+                urls.append(self.client.storage.from_(bucket).get_public_url(filename))
+                rows.append({
+                    "filename": filename,
+                    "variable": variable,
+                    "timestamp": timestamp.isoformat(),
+                    "region_hash": region_hash
+                })
+            except Exception as e:
+                print(f"Supabase Upload Error: {e}")
+                urls.append(None)
+        
+        # 2. Record in DB (one round trip for every uploaded file)
+        # We treat filename as unique Key.
+        if rows:
+            try:
+                self.client.table(self.table).upsert(rows).execute()
+            except Exception as e:
+                print(f"Supabase Upload Error: {e}")
+                return [None] * len(files)
+        
+        return urls
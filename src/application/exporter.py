@@ -4,7 +4,7 @@ import tempfile
 from datetime import datetime, timedelta, timezone
 import pandas as pd
 import xarray as xr
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 import shutil
 
 # Importing facade or adapter directly? 
@@ -20,8 +20,14 @@ from src.adapters.openmeteo import OpenMeteoAdapter
 from src.application.facade import MeteorologicalFacade
 from src.domain.model import BoundingBox, TimeRange
 
+# Exported frames are float32 Cloud-Optimized GeoTIFFs (tiled, DEFLATE with
+# the floating-point predictor): a fraction of the size of plain strip TIFFs
+TIFF_OPTIONS = {"driver": "COG", "compress": "DEFLATE", "predictor": "FLOATING_POINT", "blocksize": 256}
+
 class BulkExportService:
-    def __init__(self):
+    def __init__(self, compression: int = zipfile.ZIP_DEFLATED):
+        # ZIP member compression; ZIP_STORED skips zlib (the COGs are compressed already)
+        self.compression = compression
         self.adapter = OpenMeteoAdapter()
         self.facade = MeteorologicalFacade(self.adapter)
 
@@ -31,10 +37,12 @@ class BulkExportService:
         end_date: datetime, 
         interval_hours: int, 
         region_bbox: Tuple[float, float, float, float], 
-        resolution: float
+        resolution: float,
+        output_dir: Optional[str] = None
     ) -> Tuple[str, int]:
         """
         Generates a ZIP file containing TIFF images for the specified range and interval.
+        The ZIP is written to a new temp dir inside `output_dir` (system temp by default).
         Returns: (zip_file_path, image_count)
         """
         # Note: We will handle timezone normalization AFTER fetching the dataset structure,
@@ -74,8 +82,10 @@ class BulkExportService:
             if end_date.tzinfo is not None:
                 end_date = end_date.replace(tzinfo=None)
         
+        import rioxarray  # noqa: F401 - registers the .rio accessor used below
+        
         # Create Temp Dir for Tiffs
-        tmp_dir = tempfile.mkdtemp()
+        tmp_dir = tempfile.mkdtemp(dir=output_dir)
         tiff_dir = os.path.join(tmp_dir, "tiffs")
         os.makedirs(tiff_dir, exist_ok=True)
         
@@ -105,10 +115,10 @@ class BulkExportService:
                 filename = f"{fname[0]}_{fname[1]:02d}_{fname[2]:02d}_{fname[3]:02d}_{fname[4]:02d}.tiff"
                 full_path = os.path.join(day_dir, filename)
                 
-                # Write GeoTIFF using rio accessor (already loaded by facade imports usually, but ensuring)
+                # Write GeoTIFF using rio accessor
                 # Ensure CRS is written (Facade might set it in attrs but rio needs write_crs)
-                frame = frame.rio.write_crs("EPSG:4326")
-                frame.rio.to_raster(full_path)
+                frame = frame.astype("float32").rio.write_crs("EPSG:4326")
+                frame.rio.to_raster(full_path, **TIFF_OPTIONS)
                 
                 image_count += 1
             except (KeyError, ValueError):
@@ -121,12 +131,15 @@ class BulkExportService:
         zip_filename = f"meteo_radar_{start_date.strftime('%Y_%m_%d')}_{end_date.strftime('%Y_%m_%d')}.zip"
         zip_path = os.path.join(tmp_dir, zip_filename)
         
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        with zipfile.ZipFile(zip_path, 'w', self.compression) as zipf:
             for root, dirs, files in os.walk(tiff_dir):
                 for file in files:
                     file_path = os.path.join(root, file)
                     arcname = os.path.relpath(file_path, tiff_dir)
                     zipf.write(file_path, arcname)
+        
+        # The TIFFs now live in the ZIP; drop the staging copies
+        shutil.rmtree(tiff_dir, ignore_errors=True)
                     
         return zip_path, image_count
 
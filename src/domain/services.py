@@ -1,3 +1,4 @@
+import warnings
 import xarray as xr
 import numpy as np
 from .model import BoundingBox
@@ -22,10 +23,10 @@ class InterpolationService:
             xr.Dataset: Nuevo dataset con la malla re-muestreada.
         """
         # Obtenemos los límites actuales
-        min_lon = ds.x.min().item()
-        max_lon = ds.x.max().item()
-        min_lat = ds.y.min().item()
-        max_lat = ds.y.max().item()
+        lons = ds.x.values
+        lats = ds.y.values
+        min_lon, max_lon = float(lons.min()), float(lons.max())
+        min_lat, max_lat = float(lats.min()), float(lats.max())
         
         # Generamos la nueva malla densa
         new_lons = np.arange(min_lon, max_lon, target_resolution)
@@ -42,3 +43,28 @@ class InterpolationService:
         
         interpolated_ds.attrs["processing"] = f"Interpolated with {method} at {target_resolution} deg"
         return interpolated_ds
+
+
+class StatisticsService:
+    """
+    Servicio de dominio para reducciones espaciales por paso temporal.
+    Se ejecuta una sola vez por dataset para que la UI no recalcule en cada rerun.
+    """
+
+    @staticmethod
+    def spatial_max(values: np.ndarray) -> np.ndarray:
+        """
+        Calcula el máximo espacial (ignorando NaN) para cada instante, en una
+        sola pasada sobre el cubo.
+
+        Args:
+            values (np.ndarray): Cubo (time, y, x).
+
+        Returns:
+            np.ndarray: Máximo por instante, de forma (time,).
+        """
+        flat = values.reshape(values.shape[0], -1)
+        with warnings.catch_warnings():
+            # Instantes completamente NaN devuelven NaN sin avisos
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            return np.nanmax(flat, axis=1)
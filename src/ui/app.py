@@ -1,16 +1,16 @@
 import streamlit as st
-import time
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 from pathlib import Path
 import sys
-import pandas as pd
 
 # Fix for imports when running from subfolder
-root_path = Path(__file__).parent.parent.parent
-sys.path.append(str(root_path))
+# (guarded so reruns that re-exec the script don't keep growing sys.path)
+root_path = str(Path(__file__).parent.parent.parent)
+if root_path not in sys.path:
+    sys.path.insert(0, root_path)
 
 from src.ui.utils.helpers import inject_custom_css, get_supabase
-from src.ui.utils.data_loader import fetch_data_blocks
+from src.ui.utils.data_loader import fetch_data_blocks, get_timeline, dataset_key, compute_point_table
 from src.ui.components.sidebar import render_sidebar
 from src.ui.components.map_view import display_map
 from src.ui.components.dialogs import show_export_dialog
@@ -18,14 +18,70 @@ from src.ui.components.dialogs import show_export_dialog
 # --- Configuration ---
 st.set_page_config(layout="wide", page_title="Meteo Radar AI - Dual Mode")
 
+# Variables shown in the metrics panel
+METRIC_VARS = (
+    'temperature', 'apparent_temp', 'precipitation', 'precipitation_max',
+    'humidity', 'cloud_cover', 'wind_speed', 'wind_gusts', 'wind_direction', 'pressure'
+)
+
+def session_timeline(name: str, ds) -> tuple:
+    """
+    get_timeline memoised in session state on the dataset content key (see
+    dataset_key), like the other per-dataset caches: an id() could be reused
+    by a refetched block landing at a freed address.
+    When the data changes, the slider position `internal_<name>_idx` is moved
+    to the timestep nearest the one it pointed at, not left on the same integer.
+    """
+    state_key = f"{name}_timeline"
+    ds_key = dataset_key(ds) if ds is not None else None
+    cached = st.session_state.get(state_key)
+    if cached is None or cached[0] != ds_key:
+        previous = cached
+        cached = (ds_key, *get_timeline(ds))
+        st.session_state[state_key] = cached
+        if previous is not None:
+            _remap_position(f"internal_{name}_idx", previous[1], cached[1])
+    return cached[1], cached[2]
+
+def _remap_position(idx_key: str, old_index, new_index):
+    """Re-points a stored time position from `old_index` to the nearest entry of `new_index`."""
+    idx = st.session_state.get(idx_key)
+    if idx is None or not 0 <= idx < len(old_index) or len(new_index) == 0:
+        return
+    st.session_state[idx_key] = int(new_index.get_indexer([old_index[idx]], method="nearest")[0])
+
+# --- Widget Callbacks (module level: not redefined on every rerun) ---
+def update_hist():
+    st.session_state['internal_hist_idx'] = st.session_state.slider_history
+    st.session_state['active_mode'] = 'history'
+
+def update_fore():
+    st.session_state['internal_fore_idx'] = st.session_state.slider_forecast
+    st.session_state['active_mode'] = 'forecast'
+    
+def toggle_play_hist():
+    st.session_state['playing_hist'] = not st.session_state['playing_hist']
+    if st.session_state['playing_hist']:
+        st.session_state['playing_fore'] = False # Stop others
+        st.session_state['active_mode'] = 'history'
+        
+def toggle_play_fore():
+    st.session_state['playing_fore'] = not st.session_state['playing_fore']
+    if st.session_state['playing_fore']:
+        st.session_state['playing_hist'] = False # Stop others
+        st.session_state['active_mode'] = 'forecast'
+
+def activate_mode(mode: str):
+    # As a callback the switch lands before the rerun, not one rerun late
+    st.session_state['active_mode'] = mode
+    st.session_state['playing_hist'] = False
+    st.session_state['playing_fore'] = False
+
 def main():
     inject_custom_css()
     st.title("📡 Meteo Radar: MeteoGrid + FiClima")
     
     # --- Sidebar & Config ---
-    if 'map_refresh_trigger' not in st.session_state:
-        st.session_state.map_refresh_trigger = 0
-
     # Render sidebar and get user config
     config = render_sidebar()
     
@@ -41,85 +97,74 @@ def main():
             min_lat, max_lat, min_lon, max_lon, 
             config['resolution']
         )
-    
+
+    # Timeline, metrics and map rerun on their own (see render_dashboard)
+    render_dashboard(ds_history, ds_forecast, config)
+
+    # --- End of Main ---
+
+@st.fragment
+def render_dashboard(ds_history, ds_forecast, config):
+    """
+    Controls, metrics and map. Runs as a fragment so slider drags and play
+    toggles rerun only this block, not the sidebar or the data loading.
+    """
     # --- State Management (Defaults) ---
     if 'active_mode' not in st.session_state:
         st.session_state['active_mode'] = 'history' # Default to history as per user req
         
-    # --- Timeline Limits ---
-    min_hist, max_hist = datetime.now(timezone.utc), datetime.now(timezone.utc)
-    if ds_history and ds_history.time.size > 0:
-        times = ds_history.time.values
-        min_hist = pd_to_datetime(times.min())
-        max_hist = pd_to_datetime(times.max())
-
-    min_fore, max_fore = datetime.now(timezone.utc), datetime.now(timezone.utc)
-    if ds_forecast and ds_forecast.time.size > 0:
-        times = ds_forecast.time.values
-        min_fore = pd_to_datetime(times.min())
-        max_fore = pd_to_datetime(times.max())
+    # --- Timeline Index ---
+    # State holds integer positions into these indexes (no datetime/tz arithmetic)
+    hist_index, hist_labels = session_timeline('hist', ds_history)
+    fore_index, fore_labels = session_timeline('fore', ds_forecast)
 
     # --- Shadow State Initialization ---
-    if 'internal_hist' not in st.session_state:
-        st.session_state['internal_hist'] = max_hist # Start from LATEST time
+    last_hist = max(len(hist_index) - 1, 0)
+    if 'internal_hist_idx' not in st.session_state:
+        st.session_state['internal_hist_idx'] = last_hist # Start from LATEST time
     # Ensure internal state is within bounds (if data reloaded)
-    if st.session_state['internal_hist'] < min_hist or st.session_state['internal_hist'] > max_hist:
-        st.session_state['internal_hist'] = max_hist
+    if not 0 <= st.session_state['internal_hist_idx'] <= last_hist:
+        st.session_state['internal_hist_idx'] = last_hist
 
-    if 'internal_fore' not in st.session_state:
-        st.session_state['internal_fore'] = min_fore
-    if st.session_state['internal_fore'] < min_fore or st.session_state['internal_fore'] > max_fore:
-        st.session_state['internal_fore'] = min_fore
+    last_fore = max(len(fore_index) - 1, 0)
+    if 'internal_fore_idx' not in st.session_state:
+        st.session_state['internal_fore_idx'] = 0
+    if not 0 <= st.session_state['internal_fore_idx'] <= last_fore:
+        st.session_state['internal_fore_idx'] = 0
         
     # --- Animation State ---
     if 'playing_hist' not in st.session_state: st.session_state['playing_hist'] = False
     if 'playing_fore' not in st.session_state: st.session_state['playing_fore'] = False
 
-    # Callbacks
-    def update_hist():
-        st.session_state['internal_hist'] = st.session_state.slider_history
-        st.session_state['active_mode'] = 'history'
-    
-    def update_fore():
-        st.session_state['internal_fore'] = st.session_state.slider_forecast
-        st.session_state['active_mode'] = 'forecast'
-        
-    def toggle_play_hist():
-        st.session_state['playing_hist'] = not st.session_state['playing_hist']
-        if st.session_state['playing_hist']:
-            st.session_state['playing_fore'] = False # Stop others
-            st.session_state['active_mode'] = 'history'
-            
-    def toggle_play_fore():
-        st.session_state['playing_fore'] = not st.session_state['playing_fore']
-        if st.session_state['playing_fore']:
-            st.session_state['playing_hist'] = False # Stop others
-            st.session_state['active_mode'] = 'forecast'
-
     # --- Sync Sliders with Internal State (for Animation) ---
     # We must update the slider key BEFORE the widget is rendered to avoid StreamlitAPIException
-    if 'slider_history' in st.session_state and st.session_state['slider_history'] != st.session_state['internal_hist']:
-        st.session_state['slider_history'] = st.session_state['internal_hist']
+    if 'slider_history' in st.session_state and st.session_state['slider_history'] != st.session_state['internal_hist_idx']:
+        st.session_state['slider_history'] = st.session_state['internal_hist_idx']
         
-    if 'slider_forecast' in st.session_state and st.session_state['slider_forecast'] != st.session_state['internal_fore']:
-        st.session_state['slider_forecast'] = st.session_state['internal_fore']
+    if 'slider_forecast' in st.session_state and st.session_state['slider_forecast'] != st.session_state['internal_fore_idx']:
+        st.session_state['slider_forecast'] = st.session_state['internal_fore_idx']
 
     # --- Active Logic Setup ---
     active_ds = None
-    active_time = None
+    active_idx = 0
     start_msg = ""
     
     if st.session_state['active_mode'] == 'history':
         active_ds = ds_history
-        active_time = st.session_state['internal_hist']
-        if active_time.tzinfo is None: active_time = active_time.replace(tzinfo=timezone.utc)
+        active_index = hist_index
+        active_idx = st.session_state['internal_hist_idx']
         start_msg = f"📜 Histórico"
     else:
         active_ds = ds_forecast
-        active_time = st.session_state['internal_fore']
-        if active_time.tzinfo is None: active_time = active_time.replace(tzinfo=timezone.utc)
+        active_index = fore_index
+        active_idx = st.session_state['internal_fore_idx']
         start_msg = f"🔮 Predicción"
 
+    if len(active_index) > 0:
+        active_time = active_index[active_idx].to_pydatetime()
+    else:
+        active_time = datetime.now(timezone.utc)
+
     # --- LAYOUT: 2/3 Map, 1/3 Controls ---
     col_map, col_controls = st.columns([2, 1], gap="medium")
     
@@ -131,48 +176,47 @@ def main():
         with st.expander("📜 Histórico (Pasado)", expanded=(st.session_state['active_mode'] == 'history')):
             c_sl, c_btn = st.columns([5, 1])
             with c_sl:
-                sel_hist = st.slider(
-                    "Hora",
-                    min_value=min_hist,
-                    max_value=max_hist,
-                    value=st.session_state['internal_hist'],
-                    format="DD/MM HH:mm",
-                    key="slider_history",
-                    step=timedelta(hours=1),
-                    label_visibility="collapsed",
-                    on_change=update_hist
-                )
+                if len(hist_index) > 0:
+                    sel_hist = st.select_slider(
+                        "Hora",
+                        options=range(len(hist_index)),
+                        value=st.session_state['internal_hist_idx'],
+                        format_func=hist_labels.__getitem__,
+                        key="slider_history",
+                        label_visibility="collapsed",
+                        on_change=update_hist
+                    )
+                else:
+                    st.caption("Sin datos históricos.")
             with c_btn:
                 icon = "⏸️" if st.session_state['playing_hist'] else "▶️"
                 st.button(icon, key="btn_play_hist", on_click=toggle_play_hist)
             
-            if st.button("Activar Histórico", key="btn_activate_hist", use_container_width=True):
-                 st.session_state['active_mode'] = 'history'
-                 st.session_state['playing_hist'] = False
-                 st.session_state['playing_fore'] = False
+            st.button("Activar Histórico", key="btn_activate_hist", use_container_width=True,
+                      on_click=activate_mode, args=('history',))
 
         # 2. Forecast Control
         with st.expander("🔮 Predicción (Futuro)", expanded=(st.session_state['active_mode'] == 'forecast')):
             c_sl_f, c_btn_f = st.columns([5, 1])
             with c_sl_f:
-                sel_fore = st.slider(
-                    "Hora",
-                    min_value=min_fore,
-                    max_value=max_fore,
-                    value=st.session_state['internal_fore'],
-                    format="DD/MM HH:mm",
-                    key="slider_forecast",
-                    label_visibility="collapsed",
-                    on_change=update_fore
-                )
+                if len(fore_index) > 0:
+                    sel_fore = st.select_slider(
+                        "Hora",
+                        options=range(len(fore_index)),
+                        value=st.session_state['internal_fore_idx'],
+                        format_func=fore_labels.__getitem__,
+                        key="slider_forecast",
+                        label_visibility="collapsed",
+                        on_change=update_fore
+                    )
+                else:
+                    st.caption("Sin datos de predicción.")
             with c_btn_f:
                 icon_f = "⏸️" if st.session_state['playing_fore'] else "▶️"
                 st.button(icon_f, key="btn_play_fore", on_click=toggle_play_fore)
 
-            if st.button("Activar Predicción", key="btn_activate_fore", use_container_width=True, type="primary"):
-                 st.session_state['active_mode'] = 'forecast'
-                 st.session_state['playing_hist'] = False
-                 st.session_state['playing_fore'] = False
+            st.button("Activar Predicción", key="btn_activate_fore", use_container_width=True, type="primary",
+                      on_click=activate_mode, args=('forecast',))
 
         # 3. Metrics
         st.divider()
@@ -180,80 +224,65 @@ def main():
             st.caption(f"**Fecha:** {active_time.strftime('%d/%m/%Y %H:%M')} UTC | **Fuente:** OpenMeteo")
             
             if active_ds:
-                try:
-                    # Calculate Center of the current View (BBOX)
-                    # config['bbox'] = (min_lat, max_lat, min_lon, max_lon)
-                    c_lat = (config['bbox'][0] + config['bbox'][1]) / 2
-                    c_lon = (config['bbox'][2] + config['bbox'][3]) / 2
+                # Calculate Center of the current View (BBOX)
+                # config['bbox'] = (min_lat, max_lat, min_lon, max_lon)
+                c_lat = (config['bbox'][0] + config['bbox'][1]) / 2
+                c_lon = (config['bbox'][2] + config['bbox'][3]) / 2
+                # Per-timestep values at the CENTER point, built once per dataset.
+                # Only variables present in the dataset are sampled; missing ones
+                # fall through the dict lookup as None and render "N/A"
+                point_table = compute_point_table(active_ds, dataset_key(active_ds), c_lat, c_lon, METRIC_VARS)
+                values = dict(zip(point_table.columns, point_table.iloc[active_idx].tolist()))
+                get_val = values.get
+                    
+                def fmt(val, unit="", decimal=1):
+                    if val is None: return "N/A"
+                    return f"{val:.{decimal}f}{unit}"
 
-                    # Helper to get scalar value safely at the CENTER point
-                    def get_val(var_name, method="nearest"):
-                        if var_name in active_ds:
-                            # Use 'x' (lon) and 'y' (lat) as defined in OpenMeteoAdapter
-                            val = active_ds[var_name].sel(x=c_lon, y=c_lat, time=active_time, method=method).item()
-                            return val
-                        return None
-                        
-                    def fmt(val, unit="", decimal=1):
-                        if val is None: return "N/A"
-                        return f"{val:.{decimal}f}{unit}"
+                # --- Fetching Values (Point Specific) ---
+                temp = get_val('temperature')
+                app_temp = get_val('apparent_temp')
+                
+                # For Precip, point value is better for "Local" accuracy than mean.
+                # User likely wants to know if it rains HERE.
+                precip = get_val('precipitation') 
+                
+                # REGIONAL Max for Precipitation (useful for context)
+                max_precip = get_val('precipitation_max')
+                
+                humidity = get_val('humidity')
+                clouds = get_val('cloud_cover')
+                
+                wind = get_val('wind_speed')
+                gusts = get_val('wind_gusts')
+                wind_dir = get_val('wind_direction')
+                
+                pressure = get_val('pressure')
 
-                    # --- Fetching Values (Point Specific) ---
-                    temp = get_val('temperature')
-                    app_temp = get_val('apparent_temp')
-                    
-                    # For Precip, point value is better for "Local" accuracy than mean.
-                    # User likely wants to know if it rains HERE.
-                    precip = get_val('precipitation') 
-                    # We keep "Max in Region" as a separate interesting stat? 
-                    # The user prompt specifically complained about "Madrid was 8 degrees (mean) vs 1 degree (actual)".
-                    # So "Lluvia Max" implies Regional Max. Let's keep one regional stat or rename it.
-                    # Current label is "Lluvia Max". I will keep it as Regional Max for context but add Point Precip.
-                    
-                    # REGIONAL Max for Precipitation (useful for context)
-                    max_precip = active_ds['precipitation'].sel(time=active_time, method="nearest").max().item() if 'precipitation' in active_ds else 0
-                    
-                    humidity = get_val('humidity')
-                    clouds = get_val('cloud_cover')
-                    
-                    wind = get_val('wind_speed')
-                    gusts = get_val('wind_gusts')
-                    wind_dir = get_val('wind_direction')
-                    
-                    pressure = get_val('pressure')
+                # --- Rendering Compact Grid ---
+                # One HTML block (layout lives in inject_custom_css) instead of
+                # a markdown element per cell
+                def cell(label, value):
+                    return f"<div class='metric-cell'><span class='metric-label'>{label}</span><b>{value}</b></div>"
 
-                    # --- Rendering Compact Grid ---
-                    
+                st.html(
+                    "<div class='metrics-grid'>"
                     # Row 1: Temperature
-                    st.markdown("**🌡️ Temperatura**")
-                    c1, c2 = st.columns(2)
-                    c1.markdown(f"<span style='font-size:0.9em; color:#666'>Temperatura</span><br>**{fmt(temp, 'ºC')}**", unsafe_allow_html=True)
-                    c2.markdown(f"<span style='font-size:0.9em; color:#666'>Sensación</span><br>**{fmt(app_temp, 'ºC')}**", unsafe_allow_html=True)
-                    
-                    st.divider()
-                    
+                    "<div class='metrics-title'>🌡️ Temperatura</div>"
+                    f"<div class='metrics-row'>{cell('Temperatura', fmt(temp, 'ºC'))}{cell('Sensación', fmt(app_temp, 'ºC'))}</div>"
+                    "<hr>"
                     # Row 2: Conditions
-                    st.markdown("**🌧️ Condiciones**")
-                    c1, c2, c3 = st.columns(3)
-                    c1.markdown(f"<span style='font-size:0.8em; color:#666'>Lluvia</span><br>**{fmt(precip, ' mm')}**", unsafe_allow_html=True)
-                    c2.markdown(f"<span style='font-size:0.8em; color:#666'>Humedad</span><br>**{fmt(humidity, '%', 0)}**", unsafe_allow_html=True)
-                    c3.markdown(f"<span style='font-size:0.8em; color:#666'>Nubes</span><br>**{fmt(clouds, '%', 0)}**", unsafe_allow_html=True)
-                    
-                    st.divider()
-                    
+                    "<div class='metrics-title'>🌧️ Condiciones</div>"
+                    f"<div class='metrics-row'>{cell('Lluvia', fmt(precip, ' mm'))}{cell('Lluvia Máx', fmt(max_precip, ' mm'))}{cell('Humedad', fmt(humidity, '%', 0))}{cell('Nubes', fmt(clouds, '%', 0))}</div>"
+                    "<hr>"
                     # Row 3: Wind
-                    st.markdown("**💨 Viento**")
-                    c1, c2 = st.columns(2)
-                    c1.markdown(f"<span style='font-size:0.9em; color:#666'>Velocidad</span><br>**{fmt(wind, '')}** km/h", unsafe_allow_html=True)
-                    c2.markdown(f"<span style='font-size:0.9em; color:#666'>Rachas</span><br>**{fmt(gusts, '')}** km/h", unsafe_allow_html=True)
-                    
-                    st.divider()
-                    
+                    "<div class='metrics-title'>💨 Viento</div>"
+                    f"<div class='metrics-row'>{cell('Velocidad', fmt(wind, ' km/h'))}{cell('Rachas', fmt(gusts, ' km/h'))}</div>"
+                    "<hr>"
                     # Row 4: Pressure
-                    st.markdown(f"**⏲️ Presión:** {fmt(pressure, ' hPa', 0)}")
-
-                except Exception as e:
-                    st.warning(f"Error calculando métricas: {e}")
+                    f"<div class='metrics-title'>⏲️ Presión: <b>{fmt(pressure, ' hPa', 0)}</b></div>"
+                    "</div>"
+                )
             else:
                 st.info("Sin datos cargados.")
 
@@ -272,6 +301,7 @@ def main():
         display_map(
             active_ds, 
             active_time,
+            active_idx,
             config['bbox'],
             config['layers'],
             supabase_client,
@@ -284,11 +314,5 @@ def main():
     # Handled by Client-Side JS in map_view.py now to prevent flicker.
     # No more st.rerun() loops here.
 
-    # --- End of Main ---
-
-def pd_to_datetime(pd_dt):
-    """Helper to convert numpy/pandas datetime to py datetime with utc"""
-    return pd.to_datetime(pd_dt).to_pydatetime().replace(tzinfo=timezone.utc)
-
 if __name__ == "__main__":
     main()
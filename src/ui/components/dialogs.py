@@ -1,9 +1,49 @@
 import streamlit as st
 import os
+from pathlib import Path
 from datetime import datetime, timedelta
 from src.application.exporter import BulkExportService
 from src.ui.utils.helpers import get_radar_legend_html
 
+# Static legend markup, built once at import
+_TEMP_LEGEND_HTML = """
+    <div style="display: flex; align-items: center;">
+      <span style='margin-right:8px'>Frío</span>
+      <div style='flex-grow:1; height:20px; background: linear-gradient(to right, #313695, #4575b4, #74add1, #abd9e9, #e0f3f8, #ffffbf, #fee090, #fdae61, #f46d43, #d73027, #a50026); border-radius: 4px;'></div>
+      <span style='margin-left:8px'>Calor</span>
+    </div>
+    <div style="display: flex; justify-content: space-between; font-size: 0.8em; color: gray;">
+        <span>-20ºC</span><span>0ºC</span><span>20ºC</span><span>40ºC</span>
+    </div>
+    """
+
+_PRESSURE_LEGEND_HTML = """
+    <div style="display: flex; align-items: center;">
+      <span style='margin-right:8px'>Baja</span>
+      <div style='flex-grow:1; height:20px; background: linear-gradient(to right, #440154, #3b528b, #21908d, #5dc863, #fde725); border-radius: 4px;'></div>
+      <span style='margin-left:8px'>Alta</span>
+    </div>
+    <div style="display: flex; justify-content: space-between; font-size: 0.8em; color: gray;">
+        <span>980</span><span>1000</span><span>1020</span><span>1040</span>
+    </div>
+    """
+
+_WIND_LEGEND_HTML = """
+    <div style="display: flex; align-items: center;">
+      <span style='margin-right:8px'>Calma</span>
+      <div style='flex-grow:1; height:20px; background: linear-gradient(to right, #ffffb2, #fecc5c, #fd8d3c, #f03b20, #bd0026); border-radius: 4px;'></div>
+      <span style='margin-left:8px'>Fuerte</span>
+    </div>
+    <div style="display: flex; justify-content: space-between; font-size: 0.8em; color: gray;">
+        <span>0</span><span>20</span><span>50</span><span>100+</span>
+    </div>
+    """
+
+@st.cache_resource
+def get_exporter():
+    # One service (and its cached HTTP session) shared across export clicks
+    return BulkExportService()
+
 @st.dialog("📁 Exportar Datos")
 def show_export_dialog(min_lat, max_lat, min_lon, max_lon, resolution):
     st.write("Configura el rango de descarga:")
@@ -51,7 +91,7 @@ def show_export_dialog(min_lat, max_lat, min_lon, max_lon, resolution):
     
     if st.button("🚀 Confirmar Exportación", disabled=not valid_config, type="primary"):
         if valid_config:
-            exporter = BulkExportService()
+            exporter = get_exporter()
             with st.spinner("Generando y comprimiendo imágenes..."):
                 try:
                     # Convert date to datetime for service (Time 00:00)
@@ -66,14 +106,13 @@ def show_export_dialog(min_lat, max_lat, min_lon, max_lon, resolution):
                     
                     st.success(f"✅ ¡Exportación completada! {count} imágenes.")
                     
-                    # Read zip for download
-                    with open(zip_path, "rb") as fp:
-                        st.download_button(
-                            label="📥 Descargar ZIP",
-                            data=fp,
-                            file_name=os.path.basename(zip_path),
-                            mime="application/zip"
-                        )
+                    # Read zip for download (only rendered in the run that built it)
+                    st.download_button(
+                        label="📥 Descargar ZIP",
+                        data=Path(zip_path).read_bytes(),
+                        file_name=os.path.basename(zip_path),
+                        mime="application/zip"
+                    )
                 except Exception as e:
                     st.error(f"Error: {e}")
 
@@ -83,37 +122,10 @@ def show_legend_dialog():
     st.markdown(get_radar_legend_html(), unsafe_allow_html=True)
     
     st.markdown("### 🌡️ Temperatura (ºC)")
-    st.markdown("""
-    <div style="display: flex; align-items: center;">
-      <span style='margin-right:8px'>Frío</span>
-      <div style='flex-grow:1; height:20px; background: linear-gradient(to right, #313695, #4575b4, #74add1, #abd9e9, #e0f3f8, #ffffbf, #fee090, #fdae61, #f46d43, #d73027, #a50026); border-radius: 4px;'></div>
-      <span style='margin-left:8px'>Calor</span>
-    </div>
-    <div style="display: flex; justify-content: space-between; font-size: 0.8em; color: gray;">
-        <span>-20ºC</span><span>0ºC</span><span>20ºC</span><span>40ºC</span>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(_TEMP_LEGEND_HTML, unsafe_allow_html=True)
     
     st.markdown("### ⏲️ Presión (hPa)")
-    st.markdown("""
-    <div style="display: flex; align-items: center;">
-      <span style='margin-right:8px'>Baja</span>
-      <div style='flex-grow:1; height:20px; background: linear-gradient(to right, #440154, #3b528b, #21908d, #5dc863, #fde725); border-radius: 4px;'></div>
-      <span style='margin-left:8px'>Alta</span>
-    </div>
-    <div style="display: flex; justify-content: space-between; font-size: 0.8em; color: gray;">
-        <span>980</span><span>1000</span><span>1020</span><span>1040</span>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(_PRESSURE_LEGEND_HTML, unsafe_allow_html=True)
 
     st.markdown("### 💨 Viento (km/h)")
-    st.markdown("""
-    <div style="display: flex; align-items: center;">
-      <span style='margin-right:8px'>Calma</span>
-      <div style='flex-grow:1; height:20px; background: linear-gradient(to right, #ffffb2, #fecc5c, #fd8d3c, #f03b20, #bd0026); border-radius: 4px;'></div>
-      <span style='margin-left:8px'>Fuerte</span>
-    </div>
-    <div style="display: flex; justify-content: space-between; font-size: 0.8em; color: gray;">
-        <span>0</span><span>20</span><span>50</span><span>100+</span>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(_WIND_LEGEND_HTML, unsafe_allow_html=True)
@@ -1,44 +1,55 @@
 import folium
-import leafmap.foliumap as leafmap
 import streamlit as st
-import tempfile
+import streamlit.components.v1 as components
 import xarray as xr
 import json
-import pandas as pd
-from datetime import datetime, timezone
+import numpy as np
+from datetime import datetime
 from branca.element import MacroElement
 from jinja2 import Template
-from src.ui.utils.helpers import get_or_upload_layer
-from src.adapters.aemet import AemetAdapter
+from src.ui.utils.helpers import get_or_upload_layer, get_aemet_adapter, generate_sprite_sheet_url, build_colormap_lut, downsample_for_display
+from src.ui.utils.data_loader import get_timeline, dataset_key
+
+# Longest side of each animation frame in the sprite sheet
+MAX_SHEET_FRAME_SIDE = 512
+
+# AEMET publishes a new national composite every 10 minutes
+AEMET_COMPOSITE_TTL = 300
 
 class ImageOverlayAnimation(MacroElement):
     """
-    A custom Folium Element that handles client-side animation of ImageOverlays.
-    It preloads all images as hidden layers and cycles their opacity.
+    A custom Folium Element that handles client-side animation of a layer.
+    All frames travel as one sprite sheet (see generate_sprite_sheet_url) drawn
+    in a single SVG overlay; each tick only moves the SVG viewBox.
     """
     _template = Template(u"""
         {% macro script(this, kwargs) %}
-            var animation_layers_{{this.get_name()}} = {{this.layers_json}};
             var time_labels_{{this.get_name()}} = {{this.labels_json}};
             var interval_{{this.get_name()}} = null;
             var currentIndex_{{this.get_name()}} = 0;
             var isPlaying_{{this.get_name()}} = true;
             var frameDuration_{{this.get_name()}} = {{this.period}};
             
-            // Storage for Leaflet Layer objects
-            var leaf_layers_{{this.get_name()}} = [];
-
-            // 1. Initialize Layers (Hidden)
-            animation_layers_{{this.get_name()}}.forEach(function(frame, index) {
-                var img = L.imageOverlay(frame.url, frame.bounds, {
-                    opacity: 0,
-                    interactive: false,
-                    crossOrigin: true,
-                    zIndex: {{this.zindex}}
-                });
-                img.addTo({{this._parent.get_name()}});
-                leaf_layers_{{this.get_name()}}.push(img);
-            });
+            var sheet_{{this.get_name()}} = {{this.sheet_ref}};
+            var svgNS_{{this.get_name()}} = "http://www.w3.org/2000/svg";
+
+            // 1. Single SVG overlay holding the whole sprite sheet; a frame is
+            //    shown by moving the viewBox (one node, one image decode)
+            var svg_{{this.get_name()}} = document.createElementNS(svgNS_{{this.get_name()}}, "svg");
+            svg_{{this.get_name()}}.setAttribute("xmlns", svgNS_{{this.get_name()}});
+            svg_{{this.get_name()}}.setAttribute("preserveAspectRatio", "none");
+            var sheetImg_{{this.get_name()}} = document.createElementNS(svgNS_{{this.get_name()}}, "image");
+            sheetImg_{{this.get_name()}}.setAttribute("href", sheet_{{this.get_name()}}.url);
+            sheetImg_{{this.get_name()}}.setAttribute("width", sheet_{{this.get_name()}}.columns * sheet_{{this.get_name()}}.frame_width);
+            var tileCount_{{this.get_name()}} = sheet_{{this.get_name()}}.tiles[sheet_{{this.get_name()}}.frames - 1] + 1;
+            sheetImg_{{this.get_name()}}.setAttribute("height", Math.ceil(tileCount_{{this.get_name()}} / sheet_{{this.get_name()}}.columns) * sheet_{{this.get_name()}}.frame_height);
+            svg_{{this.get_name()}}.appendChild(sheetImg_{{this.get_name()}});
+
+            L.svgOverlay(svg_{{this.get_name()}}, {{this.bounds_json}}, {
+                opacity: {{this.opacity}},
+                interactive: false,
+                zIndex: {{this.zindex}}
+            }).addTo({{this._parent.get_name()}});
 
             // 2. Add Custom Control for Time Display / Progress
             var infoControl = L.control({position: 'bottomleft'});
@@ -65,13 +76,13 @@ class ImageOverlayAnimation(MacroElement):
 
             // 3. Function to Update Frame & UI
             function showFrame_{{this.get_name()}}(index) {
-                leaf_layers_{{this.get_name()}}.forEach(function(layer, i) {
-                    if (i === index) {
-                        layer.setOpacity({{this.opacity}});
-                    } else {
-                        layer.setOpacity(0);
-                    }
-                });
+                var sheet = sheet_{{this.get_name()}};
+                var tile = sheet.tiles[index]; // repeated timesteps reuse a tile
+                var col = tile % sheet.columns;
+                var row = Math.floor(tile / sheet.columns);
+                svg_{{this.get_name()}}.setAttribute("viewBox",
+                    (col * sheet.frame_width) + " " + (row * sheet.frame_height) + " " +
+                    sheet.frame_width + " " + sheet.frame_height);
                 
                 // Update Control
                 if (time_labels_{{this.get_name()}}.length > index) {
@@ -90,69 +101,90 @@ class ImageOverlayAnimation(MacroElement):
             function startAnimation_{{this.get_name()}}() {
                 if (interval_{{this.get_name()}}) clearInterval(interval_{{this.get_name()}});
                 interval_{{this.get_name()}} = setInterval(function() {
-                    currentIndex_{{this.get_name()}} = (currentIndex_{{this.get_name()}} + 1) % leaf_layers_{{this.get_name()}}.length;
+                    currentIndex_{{this.get_name()}} = (currentIndex_{{this.get_name()}} + 1) % sheet_{{this.get_name()}}.frames;
                     showFrame_{{this.get_name()}}(currentIndex_{{this.get_name()}});
                 }, frameDuration_{{this.get_name()}});
             }
 
+            // 5. Pause while the tab is hidden (no frame swaps nobody sees)
+            document.addEventListener('visibilitychange', function() {
+                if (document.hidden) {
+                    clearInterval(interval_{{this.get_name()}});
+                    interval_{{this.get_name()}} = null;
+                } else if (isPlaying_{{this.get_name()}}) {
+                    startAnimation_{{this.get_name()}}();
+                }
+            });
+
             // Start immediately
             showFrame_{{this.get_name()}}(0);
-            startAnimation_{{this.get_name()}}();
+            if (!document.hidden) startAnimation_{{this.get_name()}}();
 
         {% endmacro %}
     """)
 
-    def __init__(self, data, bounds, time_labels=None, period=500, zindex=1, opacity=0.6):
+    def __init__(self, sheet, bounds, time_labels=None, period=500, zindex=1, opacity=0.6):
         super(ImageOverlayAnimation, self).__init__()
         self._name = 'ImageOverlayAnimation'
         
-        # Prepare JSON data: [{url: '...', bounds: [[lat1, lon1], [lat2, lon2]]}, ...]
-        self.layers_json = json.dumps([
-            {'url': url, 'bounds': bounds} for url in data
-        ])
+        # Sprite sheet: {url, columns, frames, tiles, frame_width, frame_height}.
+        # The template only holds a placeholder; render_map splices the JSON in
+        self.sheet_json = json.dumps(sheet)
+        self.sheet_ref = f"__SHEET_{self.get_name()}__"
+        self.bounds_json = json.dumps(bounds)
         
         # Prepare labels
-        self.labels_json = json.dumps(time_labels if time_labels else [])
+        self.labels_json = json.dumps(list(time_labels or ()))
         
         self.period = period
         self.zindex = zindex
         self.opacity = opacity
 
-def display_map(
-    active_ds: xr.Dataset, 
-    active_time: datetime,
-    bbox_config: tuple, 
-    layers_state: dict,
-    supabase_client=None,
-    aemet_key: str = None,
-    animate: bool = False,
-    animation_speed: int = 500
-):
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=2048)
+def _render_layer_url(_ds, ds_key, var_name, time_pos, bbox_tuple, t_iso, colormap, vmin, vmax, _client=None, _lut=None):
     """
-    Renders the map. Supports static mode (single time) or animation mode (full timeline).
+    WebP data URL for one variable/timestep, shared across reruns and sessions.
+    `_ds`/`_client`/`_lut` are not hashed: `ds_key` (dataset_key) identifies the
+    data and `colormap` the prebuilt LUT. Raises on a failed render, so
+    st.cache_data never stores it.
     """
-    min_lat, max_lat, min_lon, max_lon = bbox_config
-    
-    # Base Map
-    m = leafmap.Map(
-        center=[(max_lat+min_lat)/2, (max_lon+min_lon)/2],
-        zoom=5.5,
-        draw_control=False,
-        measure_control=False,
+    url = get_or_upload_layer(
+        _client, _ds[var_name].isel(time=time_pos), var_name, bbox_tuple,
+        datetime.fromisoformat(t_iso), colormap=colormap, vmin=vmin, vmax=vmax, lut=_lut
     )
-    m.add_basemap("CartoDB.Positron")
-    
-    if active_ds is None:
-         m.to_streamlit(height=600, key="radar_map")
-         return
+    if not url:
+        raise RuntimeError(f"Could not render {var_name} @ {t_iso}")
+    return url
 
-    # --- 1. Calculate Bounds ---
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=64)
+def _render_animation_sheet(_ds, ds_key, var_name, colormap, vmin, vmax, _lut=None) -> dict:
+    """Sprite sheet for every timestep of `var_name`, cached like _render_layer_url."""
+    frames = downsample_for_display(_ds[var_name], MAX_SHEET_FRAME_SIDE)
+    return generate_sprite_sheet_url(frames, colormap=colormap, vmin=vmin, vmax=vmax, lut=_lut)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _global_max(_ds, ds_key, var_name) -> float:
+    """
+    Maximum of `var_name` over the whole dataset, computed once per dataset.
+    Uses the precomputed per-timestep `<var>_max` series when the loader added one.
+    """
+    series = f"{var_name}_max"
+    values = _ds[series].values if series in _ds else _ds[var_name].values
+    peak = float(np.nanmax(values)) if values.size else float('nan')
+    return peak if np.isfinite(peak) else 0.0
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _overlay_bounds(_ds, ds_key, bbox_config) -> list:
+    """
+    Leaflet [[south, west], [north, east]] bounds of the dataset grid (cell
+    edges, not centres), computed once per dataset. Falls back to `bbox_config`.
+    """
     try:
-        lat_dim = 'latitude' if 'latitude' in active_ds.coords else 'lat' if 'lat' in active_ds.coords else 'y'
-        lon_dim = 'longitude' if 'longitude' in active_ds.coords else 'lon' if 'lon' in active_ds.coords else 'x'
+        lat_dim = 'latitude' if 'latitude' in _ds.coords else 'lat' if 'lat' in _ds.coords else 'y'
+        lon_dim = 'longitude' if 'longitude' in _ds.coords else 'lon' if 'lon' in _ds.coords else 'x'
         
-        lats = active_ds[lat_dim].values
-        lons = active_ds[lon_dim].values
+        lats = _ds[lat_dim].values
+        lons = _ds[lon_dim].values
         
         lat_res = abs(float(lats[1] - lats[0])) if len(lats) > 1 else 0.01
         lon_res = abs(float(lons[1] - lons[0])) if len(lons) > 1 else 0.01
@@ -168,13 +200,79 @@ def display_map(
         half_res_lat = lat_res / 2.0
         half_res_lon = lon_res / 2.0
         
-        overlay_bounds = [
+        return [
             [(actual_min_lat - half_res_lat) - lat_offset, (actual_min_lon - half_res_lon) + lon_offset], 
             [(actual_max_lat + half_res_lat) - lat_offset, (actual_max_lon + half_res_lon) + lon_offset]
         ]
     except Exception as e:
         print(f"Error calculating bounds: {e}")
-        overlay_bounds = [[min_lat, min_lon], [max_lat, max_lon]]
+        min_lat, max_lat, min_lon, max_lon = bbox_config
+        return [[min_lat, min_lon], [max_lat, max_lon]]
+
+@st.cache_data(show_spinner=False, ttl=AEMET_COMPOSITE_TTL, max_entries=16)
+def _aemet_composite_url(aemet_key: str):
+    """
+    Latest AEMET national composite URL, re-requested at most every
+    AEMET_COMPOSITE_TTL seconds instead of on every map rebuild. Raises when
+    AEMET returns nothing, so a failed request is not cached.
+    """
+    url = get_aemet_adapter(aemet_key).get_radar_composite_url()
+    if not url:
+        raise RuntimeError("AEMET composite unavailable")
+    return url
+
+def render_map(m: folium.Map, height: int = 600) -> str:
+    """
+    Serialises the folium map in-process and embeds it as a static component.
+    Layers are already inline images, so no tile server is involved.
+    Returns the rendered HTML so callers can reuse it.
+    """
+    folium.LayerControl().add_to(m)
+    html = m.get_root().render()
+    # Sprite sheets go in after rendering: folium re-parses each rendered
+    # script as a Jinja template, which would lex every MB of the data URL
+    for child in m._children.values():
+        if isinstance(child, ImageOverlayAnimation):
+            html = html.replace(child.sheet_ref, child.sheet_json, 1)
+    components.html(html, height=height)
+    return html
+
+def display_map(
+    active_ds: xr.Dataset, 
+    active_time: datetime,
+    active_idx: int,
+    bbox_config: tuple, 
+    layers_state: dict,
+    supabase_client=None,
+    aemet_key: str = None,
+    animate: bool = False,
+    animation_speed: int = 500
+):
+    """
+    Renders the map. Supports static mode (single time) or animation mode (full timeline).
+    `active_idx` is the position of `active_time` in the dataset time axis.
+    """
+    # Widget floats can jitter between reruns; ~1 m precision keeps the map
+    # memo and layer cache keys stable
+    bbox_config = tuple(round(float(v), 5) for v in bbox_config)
+    min_lat, max_lat, min_lon, max_lon = bbox_config
+    
+    # Every layer, sheet, bound and scale below is cached per dataset, so
+    # reruns that don't change what is drawn only reassemble cached strings
+    # Base Map
+    m = folium.Map(
+        location=[(max_lat+min_lat)/2, (max_lon+min_lon)/2],
+        zoom_start=5.5,
+        tiles="CartoDB positron",
+    )
+    
+    if active_ds is None:
+         render_map(m)
+         return
+
+    # --- 1. Calculate Bounds ---
+    ds_key = dataset_key(active_ds)
+    overlay_bounds = _overlay_bounds(active_ds, ds_key, bbox_config)
 
     bbox_tuple = (min_lat, max_lat, min_lon, max_lon)
 
@@ -184,42 +282,30 @@ def display_map(
     def add_layer(var_name, display_name, colormap, vmin, vmax, zindex, opacity=0.5):
         if var_name not in active_ds: return
 
+        if isinstance(colormap, list):
+            colormap = tuple(colormap)
+        # Colormap sampled once per layer, shared by every frame rendered below
+        lut = build_colormap_lut(colormap)
+
         if animate:
-            # Generate ALL frames
-            urls = []
-            labels = []
-            times = active_ds.time.values
-            
-            # Limit to reasonable number if needed
-            for t in times:
-                # Convert numpy time/int to py datetime safely using pandas
-                dt = pd.to_datetime(t).to_pydatetime()
-                if dt.tzinfo is None:
-                    dt = dt.replace(tzinfo=timezone.utc)
-                
-                # Format label for UI
-                labels.append(dt.strftime("%d/%m %H:%M"))
-                
-                # Use the clean python datetime 'dt' for selection to avoid int64 vs datetime64 mismatch
-                layer_data = active_ds[var_name].sel(time=dt, method="nearest")
-                
-                url = get_or_upload_layer(
-                    supabase_client, layer_data, var_name, bbox_tuple, dt,
-                    colormap=colormap, vmin=vmin, vmax=vmax
-                )
-                urls.append(url)
+            # ALL frames, colourised together into one sprite sheet
+            _, labels = get_timeline(active_ds)
+            sheet = _render_animation_sheet(active_ds, ds_key, var_name, colormap, vmin, vmax, _lut=lut)
             
             # Add Animation Element
-            anim = ImageOverlayAnimation(urls, overlay_bounds, time_labels=labels, period=animation_speed, zindex=zindex, opacity=opacity)
+            anim = ImageOverlayAnimation(sheet, overlay_bounds, time_labels=list(labels), period=animation_speed, zindex=zindex, opacity=opacity)
             m.add_child(anim)
             
         else:
-            # Static Single Frame
-            layer_data = active_ds[var_name].sel(time=active_time, method="nearest")
-            path = get_or_upload_layer(
-                 supabase_client, layer_data, var_name, bbox_tuple, active_time,
-                 colormap=colormap, vmin=vmin, vmax=vmax
-            )
+            # Static Single Frame (a failed render is retried on the next rerun)
+            try:
+                path = _render_layer_url(
+                    active_ds, ds_key, var_name, active_idx, bbox_tuple, active_time.isoformat(),
+                    colormap, vmin, vmax, _client=supabase_client, _lut=lut
+                )
+            except RuntimeError as e:
+                print(f"   [ERROR] {e}")
+                return
             folium.raster_layers.ImageOverlay(
                 image=path, bounds=overlay_bounds, name=display_name,
                 opacity=opacity, interactive=False, cross_origin=False, zindex=zindex
@@ -229,10 +315,10 @@ def display_map(
     
     # Precipitation
     if layers_state.get('precip', True):
-        # Calculate Global Max for consistent animation scale
+        # Global Max for consistent animation scale (once per dataset)
         global_max = 5.0
         if 'precipitation' in active_ds:
-            global_max = max(5.0, float(active_ds['precipitation'].max().item()))
+            global_max = max(5.0, _global_max(active_ds, ds_key, 'precipitation'))
             
         add_layer('precipitation', "Radar Precipitación", 
                  ["#00000000", "#7CFC00", "#32CD32", "#FFFF00", "#FF8C00", "#FF0000"], 
@@ -261,12 +347,11 @@ def display_map(
     # AEMET Radar (Static Overlay only)
     if layers_state.get('aemet_radar', False) and aemet_key:
         try:
-            adapter = AemetAdapter(aemet_key)
-            overlay_url = adapter.get_radar_composite_url()
+            overlay_url = _aemet_composite_url(aemet_key)
             if overlay_url:
                 folium.raster_layers.ImageOverlay(
                     image=overlay_url, 
-                    bounds=adapter.national_bounds, 
+                    bounds=get_aemet_adapter(aemet_key).national_bounds, 
                     name="AEMET Radar (Oficial)",
                     opacity=0.7, 
                     interactive=False, 
@@ -277,4 +362,4 @@ def display_map(
             pass
 
     # Render
-    m.to_streamlit(height=600, key="radar_map")
+    render_map(m)
@@ -1,6 +1,40 @@
+import re
 import streamlit as st
 from src.ui.utils.helpers import get_supabase
 from src.ui.components.dialogs import show_legend_dialog
+from src.ui.utils.data_loader import snap_to_grid
+
+REGION_OPTIONS = {
+    "Norte (Mungia/Euskadi)": (38.0, 48.0, -8.0, 2.0),
+    "Centro (Madrid)": (35.0, 45.0, -9.0, 1.0),
+    "Este (Barcelona/Cat)": (36.0, 46.0, -3.0, 7.0),
+    "Noroeste (Galicia)": (38.0, 48.0, -14.0, -4.0),
+}
+
+# Map window: +/- BBOX_HALF_SIDE degrees around a centre point
+BBOX_HALF_SIDE = 10.0
+
+def _bbox_around(c_lat: float, c_lon: float, delta: float = BBOX_HALF_SIDE) -> tuple:
+    return (c_lat - delta, c_lat + delta, c_lon - delta, c_lon + delta)
+
+# Window centred on each preset region, computed once at import
+PRESET_BBOX = {
+    name: _bbox_around((min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
+    for name, (min_lat, max_lat, min_lon, max_lon) in REGION_OPTIONS.items()
+}
+
+RESOLUTION_OPTIONS = {
+    "Detalle (5.5 km/px)": 0.05,
+    "Local (11 km/px)": 0.1,
+    "Nacional (22 km/px)": 0.2,
+    "Continental (28 km/px)": 0.25,
+    "Hemisférica (55 km/px)": 0.5,
+    "Global (110 km/px)": 1.0
+}
+
+# "Lat, Lon" in decimal degrees, e.g. "43.470, -3.839"
+_NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)"
+_COORD_RE = re.compile(rf"^\s*({_NUMBER})\s*,\s*({_NUMBER})\s*$")
 
 def render_sidebar():
     """
@@ -27,62 +61,38 @@ def render_sidebar():
                 st.caption("⚠️ Requiere Key para radar oficial")
 
         st.header("📍 Región")
-        region_options = {
-            "Norte (Mungia/Euskadi)": (38.0, 48.0, -8.0, 2.0),
-            "Centro (Madrid)": (35.0, 45.0, -9.0, 1.0),
-            "Este (Barcelona/Cat)": (36.0, 46.0, -3.0, 7.0),
-            "Noroeste (Galicia)": (38.0, 48.0, -14.0, -4.0),
-        }
-        selected_region_name = st.selectbox("Seleccionar Zona", list(region_options.keys()), index=0)
-        
-        # Custom Coordinates Input
-        st.divider()
-        custom_coords = st.text_input("📍 Coordenadas (Lat, Lon)", placeholder="Ej: 43.470, -3.839")
+        # Region widgets live in a form: editing them doesn't rerun the app
+        # (and refetch data) until "Aplicar" submits the new values
+        with st.form("region_form", border=False):
+            selected_region_name = st.selectbox("Seleccionar Zona", list(REGION_OPTIONS), index=0)
+            
+            # Custom Coordinates Input
+            st.divider()
+            custom_coords = st.text_input("📍 Coordenadas (Lat, Lon)", placeholder="Ej: 43.470, -3.839")
+            st.form_submit_button("Aplicar", use_container_width=True)
         
         # Logic to determine BBox
-        if custom_coords:
-            try:
-                parts = [float(p.strip()) for p in custom_coords.split(',')]
-                if len(parts) == 2:
-                    c_lat, c_lon = parts
-                    delta = 10.0 # Fixed default for custom point
-                    min_lat, max_lat = c_lat - delta, c_lat + delta
-                    min_lon, max_lon = c_lon - delta, c_lon + delta
-                    st.toast(f"Usando coordenadas personalizadas: {c_lat}, {c_lon}", icon="🎯")
-                else:
-                    st.error("Formato inválido. Use: 'Lat, Lon'")
-                    min_lat, max_lat, min_lon, max_lon = region_options[selected_region_name]
-            except ValueError:
-                st.error("Error numérico. Asegúrese de usar puntos decimales.")
-                min_lat, max_lat, min_lon, max_lon = region_options[selected_region_name]
+        coords_match = _COORD_RE.match(custom_coords) if custom_coords else None
+        if coords_match:
+            c_lat, c_lon = map(float, coords_match.groups())
+            config['bbox'] = _bbox_around(c_lat, c_lon)
+            st.toast(f"Usando coordenadas personalizadas: {c_lat}, {c_lon}", icon="🎯")
+        elif custom_coords:
+            st.error("Formato inválido. Use: 'Lat, Lon' con puntos decimales.")
+            config['bbox'] = REGION_OPTIONS[selected_region_name]
         else:
-            preset_bbox = region_options[selected_region_name]
-            p_min_lat, p_max_lat, p_min_lon, p_max_lon = preset_bbox
-            # Center
-            c_lat = (p_min_lat + p_max_lat) / 2
-            c_lon = (p_min_lon + p_max_lon) / 2
-            
-            delta = 10.0
-            min_lat, max_lat = c_lat - delta, c_lat + delta
-            min_lon, max_lon = c_lon - delta, c_lon + delta
-            
-        config['bbox'] = (min_lat, max_lat, min_lon, max_lon)
+            config['bbox'] = PRESET_BBOX[selected_region_name]
         
         if st.button("🔄 Recargar Datos"):
             st.cache_data.clear()
             st.rerun()
             
         st.divider()
-        resolution_options = {
-            "Detalle (5.5 km/px)": 0.05,
-            "Local (11 km/px)": 0.1,
-            "Nacional (22 km/px)": 0.2,
-            "Continental (28 km/px)": 0.25,
-            "Hemisférica (55 km/px)": 0.5,
-            "Global (110 km/px)": 1.0
-        }
-        selected_res_name = st.selectbox("Resolución del radar", list(resolution_options.keys()), index=1) # Adjusted index default 
-        config['resolution'] = resolution_options[selected_res_name]
+        selected_res_name = st.selectbox("Resolución del radar", list(RESOLUTION_OPTIONS), index=1) # Adjusted index default 
+        config['resolution'] = RESOLUTION_OPTIONS[selected_res_name]
+        # Snap the bbox to the radar grid so every downstream cache key
+        # (data blocks, map memo, layer cache, uploads) sees the same tuple
+        config['bbox'] = tuple(snap_to_grid(v, config['resolution']) for v in config['bbox'])
         
         # --- Legend ---
         if st.button("📝 Ver Leyenda", use_container_width=True):
@@ -103,7 +113,6 @@ def render_sidebar():
 
         st.divider()
         st.subheader("▶️ Animación")
-        # config['auto_play'] = st.checkbox("Reproducción Automática", key="auto_play") # Moved to main area
         config['play_speed'] = st.slider("Velocidad (seg/frame)", 0.05, 2.0, 0.2)
         
         st.divider()
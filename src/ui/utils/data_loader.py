@@ -1,41 +1,247 @@
 import streamlit as st
+import pandas as pd
+import xarray as xr
+import numpy as np
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from datetime import datetime, timedelta, timezone
+from zarr.codecs import BloscCodec
 from src.adapters.openmeteo import OpenMeteoAdapter
 from src.application.facade import MeteorologicalFacade
 from src.domain.model import BoundingBox, TimeRange
+from src.domain.services import StatisticsService
+
+# Disk cache for fetched blocks (survives process restarts, unlike cache_resource).
+# The in-memory cache of _fetch_data_blocks uses the same TTL on top of it, so
+# served data is at most 2 * ZARR_CACHE_TTL (one hour) old
+ZARR_CACHE_DIR = Path(".zarr_cache")
+ZARR_CACHE_TTL = 1800
 
 @st.cache_resource
 def get_facade():
     adapter = OpenMeteoAdapter()
     return MeteorologicalFacade(provider=adapter)
 
-@st.cache_resource(ttl=3600, show_spinner=False)
+def get_time_index(ds) -> pd.DatetimeIndex:
+    """
+    Returns the dataset time axis as a UTC-aware DatetimeIndex (empty if no data).
+    UI state stores integer positions into this index instead of datetimes.
+    """
+    if ds is None or 'time' not in ds.indexes:
+        return pd.DatetimeIndex([], tz='UTC')
+    index = ds.indexes['time']
+    return index.tz_localize('UTC') if index.tz is None else index
+
+TIME_LABEL_FORMAT = "%d/%m %H:%M"
+
+def get_timeline(ds) -> tuple:
+    """
+    Returns (time_index, labels): the UTC time axis and its display strings,
+    converted in one vectorised pass and shared by the sliders and the map.
+    """
+    index = get_time_index(ds)
+    return index, index.strftime(TIME_LABEL_FORMAT)
+
+def _nearest_position(coord: np.ndarray, values) -> np.ndarray:
+    """Binary search for the closest entries of an ascending 1-D coordinate."""
+    values = np.asarray(values)
+    if len(coord) < 2:
+        return np.zeros(values.shape, dtype=np.intp)
+    pos = np.clip(np.searchsorted(coord, values), 1, len(coord) - 1)
+    return pos - (np.abs(coord[pos - 1] - values) <= np.abs(coord[pos] - values))
+
+def nearest_grid_index(ds, lat, lon) -> tuple:
+    """
+    Returns the (y, x) positions of the grid cells closest to (lat, lon).
+    Accepts scalars or arrays, so point metrics can `isel` instead of running
+    a label lookup per variable.
+    """
+    return _nearest_position(ds['y'].values, lat), _nearest_position(ds['x'].values, lon)
+
+def sample_points(ds, lats, lons, **indexers):
+    """
+    Vectorised pointwise selection: both indexers share a 'point' dim, so N
+    (lat, lon) pairs yield N samples instead of an N x N cartesian grid.
+    Extra positional `indexers` (e.g. time=idx) are applied in the same isel.
+    """
+    ys, xs = nearest_grid_index(ds, lats, lons)
+    return ds.isel(
+        y=xr.DataArray(np.atleast_1d(ys), dims="point"),
+        x=xr.DataArray(np.atleast_1d(xs), dims="point"),
+        **indexers
+    )
+
+def dataset_key(ds) -> str:
+    """
+    Cheap content key for per-dataset caches: hash of the time axis and grid
+    coordinates (tens of KB), never of the data variables themselves.
+    Time is hashed as int64 epoch ns: a tz-aware axis has an object `.values`
+    whose bytes are pointers, not timestamps.
+    """
+    digest = hashlib.md5(ds.indexes['time'].asi8.tobytes())
+    digest.update(ds['y'].values.tobytes())
+    digest.update(ds['x'].values.tobytes())
+    return digest.hexdigest()
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def compute_point_table(_ds, ds_key: str, lat: float, lon: float, variables: tuple) -> pd.DataFrame:
+    """
+    Values of `variables` at the grid cell nearest (lat, lon), one row per
+    timestep. Built once per dataset/point so metric lookups are a row fetch.
+    `_ds` is not hashed; `ds_key` (see dataset_key) identifies it.
+    """
+    available = [v for v in variables if v in _ds.data_vars]
+    if not available:
+        return pd.DataFrame(index=_ds.indexes['time'])
+    point = sample_points(_ds[available], [lat], [lon]).isel(point=0)
+    # One stacked (variable, time) block for all variables
+    stacked = point.to_array("variable").transpose("variable", "time").values
+    return pd.DataFrame(stacked.T, index=_ds.indexes['time'], columns=available)
+
+def _zarr_store_path(block: str, bbox: tuple, resolution: float) -> Path:
+    key = f"{bbox[0]:.4f}_{bbox[1]:.4f}_{bbox[2]:.4f}_{bbox[3]:.4f}_{resolution}"
+    return ZARR_CACHE_DIR / f"{block}_{hashlib.md5(key.encode()).hexdigest()[:8]}.zarr"
+
+def _cached_block(store_path: Path, fetch):
+    """
+    Returns the dataset stored at `store_path` if younger than ZARR_CACHE_TTL,
+    otherwise calls `fetch()` and persists its result as a compressed Zarr store.
+    Stores are written to a temporary sibling and swapped into place, so a
+    reader never sees a partial one.
+    """
+    if store_path.exists() and time.time() - store_path.stat().st_mtime < ZARR_CACHE_TTL:
+        try:
+            # Loaded here so an unreadable chunk falls back to a refetch
+            ds = xr.open_zarr(store_path, chunks=None, consolidated=False).load()
+            # Zarr stores naive datetimes; the app works in UTC
+            return ds.assign_coords(time=ds.indexes['time'].tz_localize('UTC'))
+        except Exception as e:
+            print(f"[CACHE] Could not read {store_path}: {e}")
+
+    ds = fetch()
+    if ds is None:
+        return ds
+
+    try:
+        index = ds.indexes['time']
+        to_store = ds.assign_coords(time=index.tz_convert(None)) if index.tz is not None else ds
+        compressor = BloscCodec(cname="zstd", clevel=3, shuffle="shuffle")
+        encoding = {
+            name: {
+                "compressors": compressor,
+                "chunks": tuple(min(c, n) for c, n in zip((24, 64, 64), var.shape)),
+            }
+            for name, var in to_store.data_vars.items() if var.ndim == 3
+        }
+        store_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(tempfile.mkdtemp(prefix=f"{store_path.name}.", dir=store_path.parent))
+        stale_path = tmp_path.with_name(tmp_path.name + ".old")
+        try:
+            to_store.to_zarr(tmp_path, mode="w", encoding=encoding, consolidated=False)
+            # os.replace cannot overwrite a non-empty directory: move the old
+            # store aside first, then swap the new one in
+            if store_path.exists():
+                os.replace(store_path, stale_path)
+            os.replace(tmp_path, store_path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            shutil.rmtree(stale_path, ignore_errors=True)
+    except Exception as e:
+        print(f"[CACHE] Could not write {store_path}: {e}")
+    return ds
+
+def _to_float32(ds):
+    """
+    Interpolation returns float64; float32 is plenty for weather fields and
+    halves the memory, Zarr size and bandwidth of every per-frame operation.
+    """
+    if ds is None:
+        return ds
+    return ds.assign({v: ds[v].astype('float32') for v in ds.data_vars if ds[v].dtype == 'float64'})
+
+def _every_other_step(ds):
+    """
+    Keeps every second timestep (2-hourly history). Positional, and applied
+    before caching so the Zarr store only holds - and decodes - the kept half.
+    """
+    return ds.isel(time=slice(None, None, 2)) if ds is not None else ds
+
+def _attach_precip_stats(ds):
+    """
+    Precomputes per-timestep regional max precipitation once per dataset, so
+    the metrics panel and map scaling read a (time,) series instead of
+    reducing the grid.
+    """
+    if ds is None or 'precipitation' not in ds:
+        return ds
+    ds['precipitation_max'] = ('time', StatisticsService.spatial_max(ds['precipitation'].values))
+    return ds
+
+def snap_to_grid(value: float, resolution: float) -> float:
+    """Rounds a coordinate to the nearest multiple of `resolution` (stable cache keys)."""
+    return round(round(value / resolution) * resolution, 6)
+
 def fetch_data_blocks(min_lat, max_lat, min_lon, max_lon, resolution):
+    """
+    Snaps the bbox to the resolution grid before hitting the cache, so float
+    jitter from widgets maps to the same cached entry.
+    """
+    return _fetch_data_blocks(
+        *(snap_to_grid(v, resolution) for v in (min_lat, max_lat, min_lon, max_lon)),
+        resolution
+    )
+
+@st.cache_resource(ttl=ZARR_CACHE_TTL, show_spinner=False)
+def _fetch_data_blocks(min_lat, max_lat, min_lon, max_lon, resolution):
     """
     Fetches both History (Past 3 days) and Forecast (Next 3 days).
     Returns two separate datasets.
-    Uses cache_resource to avoid pickling large Xarray datasets.
+    Uses cache_resource to avoid pickling large Xarray datasets; each block is
+    also persisted to a Zarr store so restarts reopen it instead of refetching.
     """
     facade = get_facade()
     bbox = BoundingBox(
         min_lat=min_lat, max_lat=max_lat,
         min_lon=min_lon, max_lon=max_lon
     )
+    bbox_key = (min_lat, max_lat, min_lon, max_lon)
     
     now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
     
     # 1. History Block (Last 15 days)
     history_start = now - timedelta(days=15)
     history_window = TimeRange(start=history_start, end=now)
-    ds_history = facade.get_history_view(bbox, history_window, resolution=resolution)
-    
-    # Subsample History to every 2 hours
-    if ds_history is not None:
-         ds_history = ds_history.sel(time=slice(None, None, 2))
     
     # 2. Forecast Block (Next 10 days)
     forecast_end = now + timedelta(days=10)
     forecast_window = TimeRange(start=now, end=forecast_end)
-    ds_forecast = facade.get_forecast_view(bbox, forecast_window, resolution=resolution)
+    
+    # Both blocks are independent I/O: fetch them concurrently so cold start
+    # costs max(history, forecast) instead of their sum
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        history_job = pool.submit(
+            _cached_block,
+            _zarr_store_path("history_2h", bbox_key, resolution),
+            lambda: _every_other_step(_to_float32(facade.get_history_view(bbox, history_window, resolution=resolution)))
+        )
+        forecast_job = pool.submit(
+            _cached_block,
+            _zarr_store_path("forecast", bbox_key, resolution),
+            lambda: _to_float32(facade.get_forecast_view(bbox, forecast_window, resolution=resolution))
+        )
+        ds_history = history_job.result()
+        ds_forecast = forecast_job.result()
+    
+    # Pull lazily opened (Zarr) blocks into RAM once; every later isel/reduction
+    # on the cached objects is then a plain NumPy operation. The deep copy
+    # detaches a freshly fetched 2-hourly history from the hourly arrays it
+    # was sliced from, so the cache does not keep the full-resolution block alive
+    ds_history = _attach_precip_stats(ds_history.load().copy(deep=True) if ds_history is not None else None)
+    ds_forecast = _attach_precip_stats(ds_forecast.load() if ds_forecast is not None else None)
     
     return ds_history, ds_forecast
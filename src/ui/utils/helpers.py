@@ -1,17 +1,33 @@
 import streamlit as st
 import tempfile
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
 import numpy as np
+from PIL import Image
 import os
 import shutil
 import xarray as xr
-import rioxarray
 from datetime import datetime
 from src.adapters.supabase_client import SupabaseClient
+from src.adapters.aemet import AemetAdapter
 import base64
+import functools
+import hashlib
+import io
 import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Persisted rasters are Cloud-Optimized GeoTIFFs: internally tiled with
+# overviews, so a COG tiler can serve viewport tiles via HTTP range requests.
+# The floating-point predictor makes DEFLATE ~2-3x tighter on smooth fields
+COG_OPTIONS = {
+    "driver": "COG", "compress": "DEFLATE", "predictor": "FLOATING_POINT",
+    "blocksize": 256, "overview_resampling": "average",
+}
+
+# One process-wide pool runs every persistence task: threads are reused and
+# at most 4 uploads share the Supabase client's pooled connections at a time
+_UPLOAD_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="Upload")
 
 def inject_custom_css():
     st.markdown("""
@@ -64,6 +80,31 @@ def inject_custom_css():
             --primary-color: #00BFFF !important;
         }
         
+        /* Metrics Panel Grid */
+        .metrics-grid {
+            font-family: "Source Sans Pro", sans-serif;
+        }
+        .metrics-grid hr {
+            margin: 0.75rem 0;
+            border: none;
+            border-top: 1px solid rgba(49, 51, 63, 0.2);
+        }
+        .metrics-title {
+            font-weight: 600;
+            margin-bottom: 0.25rem;
+        }
+        .metrics-row {
+            display: grid;
+            grid-auto-flow: column;
+            grid-auto-columns: 1fr;
+            gap: 0.5rem;
+        }
+        .metric-label {
+            display: block;
+            font-size: 0.85em;
+            color: #666;
+        }
+        
         /* Compact Metrics */
         div[data-testid="stMetric"] {
             padding: 0px !important;
@@ -78,191 +119,342 @@ def get_supabase():
     except:
         return None
 
-def generate_colored_png(da: xr.DataArray, filename: str, colormap='viridis', vmin=None, vmax=None):
+@st.cache_resource
+def get_aemet_adapter(api_key: str) -> AemetAdapter:
+    """One AEMET adapter (and HTTP session) per API key, shared across reruns."""
+    return AemetAdapter(api_key)
+
+def build_colormap_lut(colormap) -> np.ndarray:
     """
-    Saves the data array as a colored PNG image without geospatial metadata embedded.
-    Enforces Lat Descending (North -> South) to match origin='upper'.
-    Handles 'latitude'/'lat'/'y' and 'longitude'/'lon'/'x'.
+    Samples a matplotlib colormap (name or list of colours) into a (256, 4) uint8 RGBA table.
+    Tables are memoised per colormap and returned read-only.
     """
-    t_start = time.time()
-    # Identify coords
-    lat_dim = None
-    lon_dim = None
-    
-    for dim in ['latitude', 'lat', 'y']:
-        if dim in da.coords:
-            lat_dim = dim
-            break
-            
-    for dim in ['longitude', 'lon', 'x']:
-        if dim in da.coords:
-            lon_dim = dim
-            break
-
-    # Sort Lat Descending (North -> South)
+    return _colormap_lut(tuple(colormap) if isinstance(colormap, list) else colormap)
+
+@functools.lru_cache(maxsize=32)
+def _colormap_lut(colormap) -> np.ndarray:
+    # matplotlib is only needed to sample a colormap once; importing it lazily
+    # keeps it (and its font manager) off the startup path
+    import matplotlib
+    import matplotlib.colors as mcolors
+    if isinstance(colormap, tuple):
+         cmap = mcolors.LinearSegmentedColormap.from_list("custom", list(colormap))
+    else:
+         cmap = matplotlib.colormaps[colormap]
+    lut = (cmap(np.linspace(0.0, 1.0, 256)) * 255).round().astype(np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+def _orient_north_up(da: xr.DataArray, *leading_dims) -> xr.DataArray:
+    """
+    Sorts latitude descending (North -> South, origin='upper') and puts the grid
+    last as (..., lat, lon). Handles 'latitude'/'lat'/'y' and 'longitude'/'lon'/'x'.
+    """
+    lat_dim = next((d for d in ['latitude', 'lat', 'y'] if d in da.coords), None)
+    lon_dim = next((d for d in ['longitude', 'lon', 'x'] if d in da.coords), None)
+
+    # Sort Lat Descending (North -> South). Grids are monotonic, so this is
+    # usually a no-op or a flip; only irregular axes pay for a sort
     if lat_dim:
-        da = da.sortby(lat_dim, ascending=False)
+        lat_index = da.indexes.get(lat_dim)
+        if lat_index is not None and lat_index.is_monotonic_increasing and len(lat_index) > 1:
+            da = da.isel({lat_dim: slice(None, None, -1)})
+        elif lat_index is None or not lat_index.is_monotonic_decreasing:
+            da = da.sortby(lat_dim, ascending=False)
         
-    # Transpose to (Lat, Lon)
-    if lat_dim and lon_dim and len(da.dims) >= 2:
+    # Transpose to (..., Lat, Lon)
+    if lat_dim and lon_dim and len(da.dims) >= 2 and da.dims != (*leading_dims, lat_dim, lon_dim):
         try:
-            da = da.transpose(lat_dim, lon_dim)
+            da = da.transpose(*leading_dims, lat_dim, lon_dim)
         except Exception:
             pass
+    return da
+
+def downsample_for_display(da: xr.DataArray, max_side: int = 1024) -> xr.DataArray:
+    """
+    Block-averages the grid by an integer factor so neither side exceeds
+    `max_side` pixels (an overview level). Pixels beyond what the map can
+    show are never encoded or sent; Leaflet upsamples on zoom.
+    """
+    lat_dim = next((d for d in ['latitude', 'lat', 'y'] if d in da.dims), None)
+    lon_dim = next((d for d in ['longitude', 'lon', 'x'] if d in da.dims), None)
+    if not lat_dim or not lon_dim:
+        return da
+    factor = int(np.ceil(max(da.sizes[lat_dim], da.sizes[lon_dim]) / max_side))
+    if factor <= 1:
+        return da
+    return da.coarsen({lat_dim: factor, lon_dim: factor}, boundary='trim').mean()
 
-    # Normalize data
-    data = da.values
-    if vmin is None: vmin = np.nanmin(data)
-    if vmax is None: vmax = np.nanmax(data)
+def colorize(data: np.ndarray, colormap='viridis', vmin=None, vmax=None, lut=None) -> np.ndarray:
+    """
+    Maps (..., y, x) values to (..., y, x, 4) uint8 RGBA through a 256-entry LUT.
+    Missing vmin/vmax are taken per frame (last two axes); NaNs are transparent.
+    A prebuilt `lut` (see build_colormap_lut) skips sampling `colormap` again.
+    """
+    if vmin is None: vmin = np.nanmin(data, axis=(-2, -1), keepdims=True)
+    if vmax is None: vmax = np.nanmax(data, axis=(-2, -1), keepdims=True)
     
-    # Handle NaN for transparency
-    # Create matplotlib Normalize
-    norm = mcolors.Normalize(vmin=vmin, vmax=vmax)
+    # Quantize to 256 palette indices in place: a single float32 temporary
+    if lut is None:
+        lut = build_colormap_lut(colormap)
+    span = np.asarray(vmax - vmin, dtype=np.float64)
+    scale = np.divide(255.0, span, out=np.zeros_like(span), where=span > 0)
+    # C order whatever the input layout (flipped/transposed views): the packed
+    # RGBA words below are reinterpreted as bytes along the last axis
+    idx = np.subtract(data, vmin, dtype=np.float32, order='C')
+    np.multiply(idx, scale, out=idx, casting='unsafe')
     
-    # Choose colormap
-    if isinstance(colormap, list):
-         cmap = mcolors.LinearSegmentedColormap.from_list("custom", colormap)
-    else:
-         cmap = plt.get_cmap(colormap)
-         
-    # Apply colormap (returns RGBA)
-    colored_data = cmap(norm(data))
+    # Set Alpha for NaNs (NaN survives the arithmetic above). The one mask
+    # is reused below; fmax/fmin clip to [0, 255] and map NaN to 0 in the same pass
+    mask = np.isnan(idx)
+    np.fmax(idx, 0, out=idx)
+    np.fmin(idx, 255, out=idx)
     
-    # Set Alpha for NaNs
-    mask = np.isnan(data)
-    colored_data[mask] = [0, 0, 0, 0] # Transparent
+    # Colour with one 4-byte gather per pixel: the LUT viewed as packed RGBA words
+    packed = np.ascontiguousarray(lut).view(np.uint32).reshape(256)[idx.astype(np.uint8)]
+    packed[mask] = 0 # Transparent
+    return packed.view(np.uint8).reshape(*packed.shape, 4)
+
+# WebP caps each side at 16383 px; larger sprite sheets fall back to PNG
+WEBP_MAX_SIDE = 16383
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Encodes a (h, w, 4) uint8 array straight through PIL (no matplotlib figure path)."""
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(rgba)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def encode_webp(rgba: np.ndarray) -> bytes:
+    """
+    Lossy WebP for map display (alpha stays lossless): several times smaller
+    than PNG, so inline frames and sprite sheets reach the browser faster.
+    """
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(rgba)).save(buffer, format='WEBP', quality=85, method=4)
+    return buffer.getvalue()
+
+def render_colored_image(da: xr.DataArray, colormap='viridis', vmin=None, vmax=None, lut=None, encoder=encode_png) -> bytes:
+    """
+    Encodes the data array as a colored image (PNG by default, see `encoder`)
+    without geospatial metadata embedded, and returns the file bytes.
+    Enforces Lat Descending (North -> South) to match origin='upper'.
+    """
+    t_start = time.time()
+    colored_data = colorize(_orient_north_up(da).values, colormap, vmin, vmax, lut=lut)
     
-    # Save using imsave (origin='upper' matches lat descending)
-    plt.imsave(filename, colored_data, origin='upper', format='png')
+    # Row 0 is the northernmost latitude (origin='upper')
+    encoded = encoder(colored_data)
     
     print(f"   [IMG] Pixels generated in {time.time()-t_start:.4f}s")
+    return encoded
+
+def tile_frames(frames: np.ndarray) -> tuple:
+    """
+    Packs (n, h, w, 4) frames into a near-square sprite sheet, row-major.
+    Returns (sheet, columns).
+    """
+    n, h, w, c = frames.shape
+    cols = int(np.ceil(np.sqrt(n)))
+    rows = int(np.ceil(n / cols))
+    padded = np.zeros((rows * cols, h, w, c), dtype=frames.dtype)
+    padded[:n] = frames
+    sheet = padded.reshape(rows, cols, h, w, c).transpose(0, 2, 1, 3, 4).reshape(rows * h, cols * w, c)
+    return sheet, cols
+
+def generate_sprite_sheet_url(da: xr.DataArray, colormap='viridis', vmin=None, vmax=None, lut=None) -> dict:
+    """
+    Colours every timestep of a (time, lat, lon) array in one vectorised pass and
+    encodes them as a single WebP sprite sheet (base64 data URL; PNG if the
+    sheet exceeds WebP's size limit).
+    Consecutive timesteps that colour identically share one tile.
+    Returns {'url', 'columns', 'frames', 'tiles', 'frame_width', 'frame_height'},
+    where `tiles[i]` is the sheet tile shown for timestep i.
+    """
+    t_start = time.time()
+    # One C-contiguous float32 (time, lat, lon) block: colorize walks it linearly
+    stack = np.ascontiguousarray(_orient_north_up(da, 'time').values, dtype=np.float32)
+    frames = colorize(stack, colormap, vmin, vmax, lut=lut)
+    n, h, w, _ = frames.shape
+    
+    # Delta-skip: compare packed RGBA words with the previous timestep
+    words = frames.view(np.uint32).reshape(n, -1)
+    changed = np.ones(n, dtype=bool)
+    changed[1:] = (words[1:] != words[:-1]).any(axis=1)
+    tiles = np.cumsum(changed) - 1
+    
+    sheet, cols = tile_frames(frames[changed])
+    if max(sheet.shape[:2]) <= WEBP_MAX_SIDE:
+        mime, encoded = "image/webp", encode_webp(sheet)
+    else:
+        mime, encoded = "image/png", encode_png(sheet)
+    b64_data = base64.b64encode(encoded).decode()
+    
+    print(f"   [IMG] Sprite sheet ({n} frames, {int(changed.sum())} tiles) generated in {time.time()-t_start:.4f}s")
+    return {
+        'url': f"data:{mime};base64,{b64_data}",
+        'columns': cols, 'frames': n, 'tiles': tuple(tiles.tolist()),
+        'frame_width': w, 'frame_height': h,
+    }
 
 
-def _background_upload_task(client, da_bytes_or_copy, bbox, variable, timestamp, colormap, vmin, vmax):
+def _background_upload_task(client, values, coords, crs, bbox, variable, timestamp, colormap, vmin, vmax, rgba=None):
     """
     Background worker to Handle TIFF generation (CPU Heavy) + Supabase Uploads (IO Heavy).
+    Receives the raw frame (`values` plus `coords`, a {dim: ndarray} mapping in
+    dim order) and rebuilds a private DataArray for rioxarray. `rgba` is the
+    full-resolution colouring when the caller already has it.
+    Returns the uploaded URLs, or None if any step failed.
     """
     start_time = time.time()
     print(f"[BG] Starting persistence for {variable} @ {timestamp}...")
     
-    tmp_png = None
     tmp_tif = None
     
     try:
-        # 1. Setup Files
-        tmp_png = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-        tmp_png.close()
+        # 1. Setup Files (GDAL writes the COG to disk; the PNG stays in memory)
         tmp_tif = tempfile.NamedTemporaryFile(suffix=".tif", delete=False)
         tmp_tif.close()
         
-        # 2. Convert raw bytes/copy back to logic if needed, or just use da
-        # For safety/simplicity we assume 'da_bytes_or_copy' is a safe separate instance or fast clone
-        da = da_bytes_or_copy 
+        import rioxarray  # noqa: F401 - registers the .rio accessor
+        
+        # 2. Rebuild the DataArray here: its CRS attrs are local to this thread
+        da = xr.DataArray(values.astype(np.float32, copy=False), coords=coords, dims=tuple(coords), name=variable)
         
-        # 3. Generate PNG (Redundant extraction but ensures clean file for upload)
-        generate_colored_png(da, tmp_png.name, colormap, vmin, vmax)
+        # 3. Generate PNG (reusing the preview's pixels when they are full resolution)
+        png_bytes = encode_png(rgba) if rgba is not None else render_colored_image(da, colormap, vmin, vmax)
         
         # 4. Generate TIFF (Heavy Operation)
         t_tiff = time.time()
-        if not hasattr(da, 'rio'):
-            import rioxarray
-        
-        if da.rio.crs is None:
-             da.rio.write_crs("EPSG:4326", inplace=True)
+        da.rio.write_crs(crs or "EPSG:4326", inplace=True)
              
-        da.rio.to_raster(tmp_tif.name)
-        print(f"   [BG] TIFF Generated in {time.time()-t_tiff:.3f}s")
+        da.rio.to_raster(tmp_tif.name, **COG_OPTIONS)
+        print(f"   [BG] COG Generated in {time.time()-t_tiff:.3f}s")
         
         # 5. Upload BOTH
         # Even if PNG exists (local render), we want it on cloud for future cache
         t_up = time.time()
-        client.upload_file(tmp_tif.name, bbox, variable, timestamp, ext=".tif", mime="image/tiff", bucket="radar_tiffs")
-        client.upload_file(tmp_png.name, bbox, variable, timestamp, ext=".png", mime="image/png", bucket="radar_pngs")
+        urls = client.upload_files([
+            (tmp_tif.name, ".tif", "image/tiff", "radar_tiffs"),
+            (png_bytes, ".png", "image/png", "radar_pngs"),
+        ], bbox, variable, timestamp)
         print(f"   [BG] Uploads completed in {time.time()-t_up:.3f}s")
         
         print(f"[BG] Task COMPLETED for {variable} in {time.time()-start_time:.3f}s")
+        return urls
 
     except Exception as e:
         print(f"[BG] ERROR in background task: {e}")
     finally:
         # Cleanup
         try:
-            if tmp_png: os.remove(tmp_png.name)
             if tmp_tif: os.remove(tmp_tif.name)
         except:
             pass
 
 
-def get_or_upload_layer(client, da: xr.DataArray, variable: str, bbox: tuple, timestamp: datetime, colormap='viridis', vmin=None, vmax=None) -> str:
+# Content digest last persisted per layer (bbox, variable, timestamp, colormap),
+# shared across sessions: identical rasters are never uploaded twice. Recorded
+# only once an upload succeeds, so failed layers are retried; LRU-bounded
+_PERSISTED_DIGESTS = OrderedDict()
+_PERSISTED_DIGESTS_SIZE = 4096
+_PERSISTED_LOCK = threading.Lock()
+
+def _is_persisted(persist_key: tuple, digest: str) -> bool:
+    with _PERSISTED_LOCK:
+        if _PERSISTED_DIGESTS.get(persist_key) != digest:
+            return False
+        _PERSISTED_DIGESTS.move_to_end(persist_key)
+        return True
+
+def _record_persisted(persist_key: tuple, digest: str, future) -> None:
+    """Upload-future done-callback: remembers `digest` if every file was uploaded."""
+    urls = future.result()
+    if not urls or None in urls:
+        return
+    with _PERSISTED_LOCK:
+        _PERSISTED_DIGESTS[persist_key] = digest
+        _PERSISTED_DIGESTS.move_to_end(persist_key)
+        if len(_PERSISTED_DIGESTS) > _PERSISTED_DIGESTS_SIZE:
+            _PERSISTED_DIGESTS.popitem(last=False)
+
+def content_digest(values: np.ndarray) -> str:
+    """Fast 128-bit content hash of an array's raw bytes."""
+    return hashlib.blake2b(np.ascontiguousarray(values).tobytes(), digest_size=16).hexdigest()
+
+# Previews kept per session in `layer_cache` (least recently used evicted first)
+LAYER_CACHE_SIZE = 256
+
+def get_or_upload_layer(client, da: xr.DataArray, variable: str, bbox: tuple, timestamp: datetime, colormap='viridis', vmin=None, vmax=None, lut=None) -> str:
     """
     OPTIMIZED for Speed Parity:
-    1. IMMEDAITELY generates PNG locally and returns Base64 (Blocking only for rendering).
-    2. Spawns Background Thread to handle TIFF conversion + Cloud Uploads.
+    1. IMMEDAITELY generates a WebP locally and returns Base64 (Blocking only for rendering).
+    2. Queues TIFF conversion + Cloud Uploads on the background upload pool.
     """
     t_start = time.time()
     print(f"[LAYER] Request: {variable} | {timestamp.strftime('%H:%M')}")
 
-    # 0. Check Session Cache (RAM)
+    # 0. Check Session Cache (RAM), keyed on pixel content: refetched data
+    # invalidates it and identical frames share one encode. LRU-bounded so
+    # long sessions don't accumulate base64 previews
     if 'layer_cache' not in st.session_state:
-        st.session_state['layer_cache'] = {}
+        st.session_state['layer_cache'] = OrderedDict()
+    layer_cache = st.session_state['layer_cache']
         
-    cache_key = f"{bbox}_{variable}_{timestamp.isoformat()}_{colormap}"
+    digest = content_digest(da.values)
+    cache_key = (variable, digest, tuple(colormap) if isinstance(colormap, list) else colormap, vmin, vmax)
     
     # If valid cache, return immediately
-    if cache_key in st.session_state['layer_cache']:
+    if cache_key in layer_cache:
         # print(f"   [CACHE] Hit! ({time.time()-t_start:.4f}s)")
-        return st.session_state['layer_cache'][cache_key]
+        layer_cache.move_to_end(cache_key)
+        return layer_cache[cache_key]
 
-    # 1. Fast Path: Generate Local PNG for Map
-    tmp_png = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-    tmp_png.close()
-    
+    # 1. Fast Path: Encode a WebP in memory for the Map
     base64_url = ""
     
     try:
         # Generate Pixels
-        generate_colored_png(da, tmp_png.name, colormap, vmin, vmax)
-        
-        # Read as Base64
-        with open(tmp_png.name, "rb") as f:
-            b64_data = base64.b64encode(f.read()).decode()
-        base64_url = f"data:image/png;base64,{b64_data}"
+        # Preview at display resolution; the background task keeps full resolution
+        preview = downsample_for_display(da)
+        rgba = colorize(_orient_north_up(preview).values, colormap, vmin, vmax, lut=lut)
+        encoded = encode_webp(rgba)
+        b64_data = base64.b64encode(encoded).decode()
+        base64_url = f"data:image/webp;base64,{b64_data}"
         
         # Cache RAM
-        st.session_state['layer_cache'][cache_key] = base64_url
+        layer_cache[cache_key] = base64_url
+        if len(layer_cache) > LAYER_CACHE_SIZE:
+            layer_cache.popitem(last=False)
         print(f"   [UI] Ready to render in {time.time()-t_start:.4f}s")
         
     except Exception as e:
         print(f"   [ERROR] Generating local preview: {e}")
         return ""
-    finally:
-        try:
-             os.remove(tmp_png.name)
-        except:
-             pass
-
-    # 2. Persistence Path: Background Thread (If Client is Available)
-    if client:
-        # Clone DataArray to ensure thread safety (shallow copy is usually enough for reading, deep if needed)
-        # Using .copy(deep=True) is safer but slower. 
-        # Since we are just reading, shallow copy + in-memory data is fine.
-        da_safe = da.copy() 
+
+    # 2. Persistence Path: Background Pool (If Client is Available)
+    persist_key = (bbox, variable, timestamp.isoformat(), str(colormap))
+    if client and _is_persisted(persist_key, digest):
+        print("   [CACHE] Same content already persisted - Skipping Upload.")
+    elif client:
+        # Hand over the (read-only) arrays rather than a deep DataArray copy;
+        # the worker wraps them in its own DataArray
+        coords = {dim: da[dim].values for dim in da.dims}
+        crs = da.rio.crs if hasattr(da, 'rio') else None
         
-        t = threading.Thread(
-            target=_background_upload_task,
-            args=(client, da_safe, bbox, variable, timestamp, colormap, vmin, vmax),
-            name=f"Upload-{variable}-{timestamp.strftime('%H%M')}"
+        # A preview that was not downsampled already holds the upload's pixels
+        future = _UPLOAD_POOL.submit(
+            _background_upload_task,
+            client, da.values, coords, crs, bbox, variable, timestamp, colormap, vmin, vmax,
+            rgba if preview is da else None
         )
-        t.daemon = True
-        t.start()
-        print(f"   [THREAD] Background Persistence Started.")
+        future.add_done_callback(functools.partial(_record_persisted, persist_key, digest))
+        print(f"   [THREAD] Background Persistence Queued.")
     else:
         print("   [WARN] No Supabase Client - Skipping Persistence.")
 
     return base64_url
 
-def get_radar_legend_html():
-    return """
+_RADAR_LEGEND_HTML = """
     <div class="sidebar-legend">
         <label>Intensidad de Lluvia (mm/h)</label>
         <div class="legend-gradient"></div>
@@ -274,3 +466,6 @@ def get_radar_legend_html():
         </div>
     </div>
     """
+
+def get_radar_legend_html():
+    return _RADAR_LEGEND_HTML
@@ -9,7 +9,11 @@ def test_time_index():
     end = 1672617600   # 2023-01-02 00:00:00 UTC
     interval = 3600
     
-    time_steps = pd.to_datetime(np.arange(start, end, interval), unit='s', utc=True)
+    # Epoch seconds -> datetime64 is a numpy cast; localising the result to
+    # UTC avoids to_datetime's per-unit conversion path
+    time_steps = pd.DatetimeIndex(
+        np.arange(start, end, interval).astype('datetime64[s]').astype('datetime64[ns]')
+    ).tz_localize('UTC')
     print(f"Time steps dtype: {time_steps.dtype}")
     print(f"Time steps tz: {time_steps.tz}")
     
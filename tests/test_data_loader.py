@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from src.ui.utils.data_loader import _cached_block, _nearest_position, dataset_key, snap_to_grid
+
+
+def _tz_aware_dataset(tz='UTC'):
+    times = pd.date_range("2024-01-01", periods=6, freq="h", tz=tz)
+    ys, xs = np.linspace(40.0, 41.0, 3), np.linspace(-4.0, -3.0, 4)
+    data = np.zeros((len(times), len(ys), len(xs)), dtype=np.float32)
+    return xr.Dataset(
+        {"temperature_2m": (("time", "y", "x"), data)},
+        coords={"time": times, "y": ys, "x": xs},
+    )
+
+
+def test_dataset_key_stable_for_tz_aware_time():
+    ds = _tz_aware_dataset()
+    # Object-dtype time values would hash their pointers, not the instants
+    assert ds['time'].values.dtype == object
+    assert dataset_key(ds) == dataset_key(ds)
+    assert dataset_key(ds) == dataset_key(_tz_aware_dataset())
+
+
+def test_dataset_key_tracks_time_axis():
+    ds = _tz_aware_dataset()
+    shifted = ds.assign_coords(time=ds.indexes['time'] + pd.Timedelta(hours=1))
+    assert dataset_key(ds) != dataset_key(shifted)
+
+
+def test_nearest_position_single_element_coordinate():
+    coord = np.array([40.0])
+    np.testing.assert_array_equal(_nearest_position(coord, [39.0, 40.0, 45.0]), [0, 0, 0])
+
+
+def test_nearest_position_edges_and_ties():
+    coord = np.array([0.0, 1.0, 2.0])
+    # Outside the axis clamps to the ends; a value halfway between picks the lower cell
+    np.testing.assert_array_equal(_nearest_position(coord, [-5.0, 0.4, 0.5, 1.6, 9.0]), [0, 0, 0, 2, 2])
+
+
+def test_snap_to_grid():
+    assert snap_to_grid(40.0499999, 0.1) == 40.0
+    assert snap_to_grid(-3.96, 0.05) == -3.95
+
+
+def test_cached_block_round_trip_keeps_utc(tmp_path):
+    ds = _tz_aware_dataset()
+    store = tmp_path / "block.zarr"
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        return ds
+
+    assert _cached_block(store, fetch) is ds
+    cached = _cached_block(store, fetch)
+    assert len(fetches) == 1
+    # Stored naive, reopened as the same UTC instants
+    assert str(cached.indexes['time'].tz) == 'UTC'
+    assert cached.indexes['time'].equals(ds.indexes['time'])
+    assert dataset_key(cached) == dataset_key(ds)
+    np.testing.assert_array_equal(cached['temperature_2m'].values, ds['temperature_2m'].values)
+    # The swap leaves no temporary siblings behind
+    assert [p.name for p in tmp_path.iterdir()] == ["block.zarr"]
@@ -1,44 +1,67 @@
+import pytest
+
+# The timezone scenarios follow pandas 2 datetime semantics; checked before
+# xarray and the exporter pull pandas in
+pd = pytest.importorskip("pandas", minversion="2.0")
+
 import xarray as xr
-import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta, timezone
-import sys
-import os
-import shutil
-import rioxarray
-
-# Ensure we can import src
-sys.path.append(os.getcwd())
+from datetime import datetime, timezone
+import copy
+import functools
+import tempfile
+import zipfile
+import logging
+from pathlib import Path
 
 from src.application.exporter import BulkExportService
-from src.domain.model import BoundingBox, TimeRange
+
+log = logging.getLogger(__name__)
+
+# Field value of every mock cell: the test checks timestamps and I/O, not
+# data, so a broadcast constant (4 bytes of storage) stands in for a field.
+# float32 because the exporter writes float32 rasters
+MOCK_VALUE = np.float32(0.5)
+
+@functools.lru_cache(maxsize=None)
+def _grid_coords(min_lat, max_lat, min_lon, max_lon):
+    """(y, x) coordinate arrays of the mock 2x2 grid, built once per bbox (read-only, shared)."""
+    ys, xs = np.array([min_lat, max_lat]), np.array([min_lon, max_lon])
+    ys.setflags(write=False)
+    xs.setflags(write=False)
+    return ys, xs
+
+HOUR_NS = 3600 * 10**9
+
+def _wall_ns(dt: datetime) -> int:
+    """Epoch nanoseconds of `dt`'s wall-clock time, ignoring its tzinfo."""
+    ts = pd.Timestamp(dt)
+    return (ts.tz_localize(None) if ts.tz is not None else ts).value
 
 # Mock Facade that can switch between UTC and Naive
 class MockFacade:
     def __init__(self, mode='utc'):
         self.mode = mode
+        # Fixed per facade: the tz the time axis is labelled with
+        self._tz = 'UTC' if mode == 'utc' else None
 
     def get_history_view(self, region, time_window, resolution):
-        print(f"MockFacade ({self.mode}) received time_window: {time_window.start} to {time_window.end}")
+        log.debug("MockFacade (%s) received time_window: %s to %s", self.mode, time_window.start, time_window.end)
         
         # Create timestamps
-        freq = '1H'
-        tz = 'UTC' if self.mode == 'utc' else None
-        
-        # We need to handle the fact that time_window might be mixed awareness if logic isn't perfect
-        # But here we just produce the dataset requested by the test setup
-        if time_window.start.tzinfo and self.mode == 'naive':
-             s = time_window.start.replace(tzinfo=None)
-             e = time_window.end.replace(tzinfo=None)
-        else:
-             s = time_window.start
-             e = time_window.end
+        # The window may be aware or naive whatever the mode; either way the
+        # axis spans its wall-clock times (any input tz is dropped)
+        start_ns, end_ns = _wall_ns(time_window.start), _wall_ns(time_window.end)
              
-        times = pd.date_range(start=s, end=e, freq=freq, tz=tz)
+        # Hourly axis as int64 nanoseconds, localised once: avoids
+        # date_range's tz-aware construction path
+        ns = np.arange(start_ns, end_ns + 1, HOUR_NS, dtype=np.int64)
+        times = pd.DatetimeIndex(ns.view('datetime64[ns]'))
+        if self._tz:
+            times = times.tz_localize(self._tz)
         
-        lats = [region.min_lat, region.max_lat]
-        lons = [region.min_lon, region.max_lon]
-        data = np.random.rand(len(times), 2, 2)
+        lats, lons = _grid_coords(region.min_lat, region.max_lat, region.min_lon, region.max_lon)
+        data = np.broadcast_to(MOCK_VALUE, (len(times), len(lats), len(lons)))
         
         ds = xr.Dataset(
             data_vars={'precipitation': (('time', 'y', 'x'), data)},
@@ -46,34 +69,48 @@ class MockFacade:
         )
         return ds
 
-def test_dynamic_scenarios():
-    bbox = (36.0, 37.0, -5.0, -4.0)
-    resolution = 0.1
-    interval = 1
+BBOX = (36.0, 37.0, -5.0, -4.0)
+RESOLUTION = 0.1
+INTERVAL = 1
+# The export runs through the end day: 2023-01-01 00:00 .. 2023-01-02 23:00 hourly
+EXPECTED_FRAMES = 48
+
+SCENARIOS = [
+    ("utc_ds_naive_input", "utc", None),
+    ("naive_ds_naive_input", "naive", None),
+    # ("utc_ds_aware_input", "utc", timezone.utc), # Less likely from streamlit but good to support
+]
+
+@pytest.fixture(scope="module")
+def exporter():
+    # One service per module (its constructor opens the HTTP cache); the
+    # fixture ZIPs need no compression
+    return BulkExportService(compression=zipfile.ZIP_STORED)
+
+@pytest.mark.parametrize("name,ds_mode,input_tz", SCENARIOS, ids=[s[0] for s in SCENARIOS])
+def test_dynamic_scenarios(exporter, name, ds_mode, input_tz):
+    log.debug("--- Testing Scenario: %s ---", name)
+    # Shallow copy carrying this scenario's facade; the shared service is untouched
+    scenario_exporter = copy.copy(exporter)
+    scenario_exporter.facade = MockFacade(mode=ds_mode)
     
-    scenarios = [
-        ("utc_ds_naive_input", "utc", None),
-        ("naive_ds_naive_input", "naive", None),
-        # ("utc_ds_aware_input", "utc", timezone.utc), # Less likely from streamlit but good to support
-    ]
+    start = datetime(2023, 1, 1, 0, 0, 0, tzinfo=input_tz)
+    end = datetime(2023, 1, 2, 0, 0, 0, tzinfo=input_tz)
     
-    for name, ds_mode, input_tz in scenarios:
-        print(f"\n--- Testing Scenario: {name} ---")
-        exporter = BulkExportService()
-        exporter.facade = MockFacade(mode=ds_mode)
-        
-        start = datetime(2023, 1, 1, 0, 0, 0, tzinfo=input_tz)
-        end = datetime(2023, 1, 2, 0, 0, 0, tzinfo=input_tz)
-        
-        try:
-            zip_path, count = exporter.generate_bulk_zip(start, end, interval, bbox, resolution)
-            print(f"SUCCESS: Generated {count} images.")
-            if os.path.exists(zip_path):
-                os.remove(zip_path)
-        except Exception as e:
-            print(f"FAIL: {e}")
-            import traceback
-            traceback.print_exc()
+    # Each export writes into its own temp dir, removed wholesale on exit
+    with tempfile.TemporaryDirectory() as output_dir:
+        zip_path, count = scenario_exporter.generate_bulk_zip(start, end, INTERVAL, BBOX, RESOLUTION, output_dir=output_dir)
+        assert Path(zip_path).is_relative_to(output_dir)
+        # Misaligned timestamps are skipped per frame, not raised: count them
+        assert count == EXPECTED_FRAMES
+        with zipfile.ZipFile(zip_path) as zipf:
+            assert len(zipf.infolist()) == EXPECTED_FRAMES
+            assert all(info.compress_type == zipfile.ZIP_STORED for info in zipf.infolist())
+    log.debug("SUCCESS: Generated %d images.", count)
 
 if __name__ == "__main__":
-    test_dynamic_scenarios()
+    logging.basicConfig(format="%(message)s")
+    log.setLevel(logging.DEBUG)
+    service = BulkExportService(compression=zipfile.ZIP_STORED)
+    for scenario in SCENARIOS:
+        test_dynamic_scenarios(service, *scenario)
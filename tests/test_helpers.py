@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from src.ui.utils.helpers import build_colormap_lut, colorize, generate_sprite_sheet_url
+
+LUT = build_colormap_lut("viridis")
+
+
+def test_colorize_nan_is_transparent():
+    data = np.array([[0.0, np.nan], [5.0, 10.0]], dtype=np.float32)
+    rgba = colorize(data, vmin=0.0, vmax=10.0, lut=LUT)
+    assert rgba.shape == (2, 2, 4)
+    assert (rgba[0, 1] == 0).all()
+    assert (rgba[[0, 1, 1], [0, 0, 1], 3] == 255).all()
+
+
+def test_colorize_clips_to_vmin_vmax():
+    data = np.array([[-50.0, 0.0], [10.0, 99.0]], dtype=np.float32)
+    rgba = colorize(data, vmin=0.0, vmax=10.0, lut=LUT)
+    np.testing.assert_array_equal(rgba[0, 0], LUT[0])
+    np.testing.assert_array_equal(rgba[0, 1], LUT[0])
+    np.testing.assert_array_equal(rgba[1, 0], LUT[255])
+    np.testing.assert_array_equal(rgba[1, 1], LUT[255])
+
+
+def test_colorize_per_frame_range_and_flat_frame():
+    # Without vmin/vmax each frame spans the full LUT; a flat frame maps to index 0
+    data = np.stack([np.array([[1.0, 3.0]]), np.full((1, 2), 7.0)]).astype(np.float32)
+    rgba = colorize(data, lut=LUT)
+    np.testing.assert_array_equal(rgba[0, 0], [LUT[0], LUT[255]])
+    np.testing.assert_array_equal(rgba[1, 0], [LUT[0], LUT[0]])
+
+
+def test_sprite_sheet_reuses_tiles_for_repeated_frames():
+    frames = np.array([0.0, 0.0, 1.0, 1.0, 0.0], dtype=np.float32)[:, None, None] * np.ones((1, 2, 3), np.float32)
+    da = xr.DataArray(
+        frames, dims=("time", "y", "x"),
+        coords={"time": pd.date_range("2024-01-01", periods=5, freq="h"), "y": [40.0, 41.0], "x": [-4.0, -3.5, -3.0]},
+    )
+    sheet = generate_sprite_sheet_url(da, vmin=0.0, vmax=1.0, lut=LUT)
+    # Only consecutive repeats are skipped: the last frame gets its own tile
+    assert sheet['tiles'] == (0, 0, 1, 1, 2)
+    assert sheet['frames'] == 5
+    assert (sheet['frame_width'], sheet['frame_height']) == (3, 2)
+    assert sheet['url'].startswith("data:image/webp;base64,")
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import pandas as pd
+import streamlit as st
+import xarray as xr
+
+from src.ui.components import map_view
+
+
+def _tz_aware_dataset():
+    # The time axis the OpenMeteo adapter and the Zarr cache both hand back
+    times = pd.date_range("2024-01-01", periods=4, freq="h", tz="UTC")
+    ys, xs = np.linspace(40.0, 41.0, 3), np.linspace(-4.0, -3.0, 4)
+    data = np.linspace(0.0, 4.0, len(times) * len(ys) * len(xs), dtype=np.float32)
+    return xr.Dataset(
+        {"precipitation": (("time", "y", "x"), data.reshape(len(times), len(ys), len(xs)))},
+        coords={"time": times, "y": ys, "x": xs},
+    )
+
+
+def test_display_map_reuses_cached_sheet(monkeypatch):
+    sheets, embedded = [], []
+    render_sheet = map_view.generate_sprite_sheet_url
+
+    def counting_sheet(*args, **kwargs):
+        sheet = render_sheet(*args, **kwargs)
+        sheets.append(sheet)
+        return sheet
+
+    monkeypatch.setattr(map_view, "generate_sprite_sheet_url", counting_sheet)
+    monkeypatch.setattr(map_view.components, "html", lambda html, height: embedded.append(html))
+    st.cache_data.clear()
+
+    ds = _tz_aware_dataset()
+    args = (ds, ds.indexes['time'][0].to_pydatetime(), 0, (40.0, 41.0, -4.0, -3.0), {'precip': True})
+    map_view.display_map(*args, animate=True)
+    map_view.display_map(*args, animate=True)
+
+    # The rebuild reuses the cached sheet, spliced in place of its placeholder
+    assert len(sheets) == 1
+    assert len(embedded) == 2
+    for html in embedded:
+        assert sheets[0]['url'] in html
+        assert "__SHEET_" not in html
+
+
+def test_failed_layer_render_is_not_cached(monkeypatch):
+    results = iter(["", "data:image/webp;base64,AAAA"])
+    monkeypatch.setattr(map_view, "get_or_upload_layer", lambda *args, **kwargs: next(results))
+    st.cache_data.clear()
+
+    ds = _tz_aware_dataset()
+    args = (ds, "key", "precipitation", 0, (40.0, 41.0, -4.0, -3.0), "2024-01-01T00:00:00+00:00", "viridis", 0, 5)
+    with pytest.raises(RuntimeError):
+        map_view._render_layer_url(*args)
+    assert map_view._render_layer_url(*args) == "data:image/webp;base64,AAAA"
@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+from src.adapters.supabase_client import SupabaseClient
+
+
+class FakeBucket:
+    def __init__(self, name, uploads, fail):
+        self.name, self.uploads, self.fail = name, uploads, fail
+
+    def upload(self, file, path, file_options):
+        if self.name in self.fail:
+            raise RuntimeError("upload refused")
+        # storage3 accepts raw bytes as well as open files
+        self.uploads.append((self.name, path, file if isinstance(file, bytes) else file.read()))
+
+    def get_public_url(self, path):
+        return f"https://storage/{self.name}/{path}"
+
+
+class FakeSupabase:
+    """Records storage uploads and table upserts instead of calling Supabase."""
+    def __init__(self, fail=()):
+        self.uploads, self.upserts, self.fail = [], [], fail
+        self.storage = self
+
+    def from_(self, bucket):
+        return FakeBucket(bucket, self.uploads, self.fail)
+
+    def table(self, name):
+        return self
+
+    def upsert(self, rows):
+        self.upserts.append(rows)
+        return self
+
+    def execute(self):
+        return self
+
+
+def _client(fake):
+    client = SupabaseClient.__new__(SupabaseClient)
+    client.client, client.bucket, client.table = fake, "radar_cache", "cache_entries"
+    return client
+
+
+BBOX = (40.0, 41.0, -4.0, -3.0)
+TIMESTAMP = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def test_upload_files_batches_db_rows(tmp_path):
+    tif = tmp_path / "layer.tif"
+    tif.write_bytes(b"tiff")
+    fake = FakeSupabase()
+    urls = _client(fake).upload_files([
+        (str(tif), ".tif", "image/tiff", "radar_tiffs"),
+        (b"png", ".png", "image/png", "radar_pngs"),
+    ], BBOX, "precipitation", TIMESTAMP)
+
+    assert [bucket for bucket, _, _ in fake.uploads] == ["radar_tiffs", "radar_pngs"]
+    assert [data for _, _, data in fake.uploads] == [b"tiff", b"png"]
+    # Both files are recorded in a single upsert
+    assert len(fake.upserts) == 1 and len(fake.upserts[0]) == 2
+    assert urls == [f"https://storage/{bucket}/{path}" for bucket, path, _ in fake.uploads]
+
+
+def test_upload_files_reports_failed_upload_as_none():
+    fake = FakeSupabase(fail=("radar_tiffs",))
+    urls = _client(fake).upload_files([
+        (b"tiff", ".tif", "image/tiff", "radar_tiffs"),
+        (b"png", ".png", "image/png", "radar_pngs"),
+    ], BBOX, "precipitation", TIMESTAMP)
+
+    assert urls[0] is None and urls[1].startswith("https://storage/radar_pngs/")
+    assert len(fake.upserts) == 1 and len(fake.upserts[0]) == 1